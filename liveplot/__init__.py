@@ -1 +1,6 @@
-from .client import LivePlotClient
+try:
+    from .client import LivePlotClient
+except ImportError:
+    # without PyQt5 only the asyncio client can be used
+    pass
+from .async_client import AsyncLivePlotClient
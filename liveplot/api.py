@@ -0,0 +1,196 @@
+import abc
+import numpy as np
+
+__author__ = 'phil'
+
+
+class PlotAPI(abc.ABC):
+    """
+    The plotting methods of LivePlotClient and AsyncLivePlotClient. They describe the
+    operation and return whatever the client's send_to_plotter returns, which for
+    AsyncLivePlotClient is a coroutine to await.
+    """
+    def get_buffer(self, shape, dtype=float):
+        return np.empty(shape, dtype)
+
+    @abc.abstractmethod
+    def send_to_plotter(self, meta, arr=None):
+        """Sends the operation described by meta, with arr if it has one; subclasses provide it"""
+
+    def plot_y(self, name, arr, extent=None, start_step=(0, 1), label=''):
+        arr = np.asarray(arr)
+        if extent is not None and start_step is not None:
+            raise ValueError('extent and start_step provide the same info and are thus mutually exclusive')
+        if extent is not None:
+            x0, x1 = extent
+            nx = len(arr)
+            start_step = x0, float(x1 - x0)/nx
+        meta = {
+            'name': name,
+            'operation':'plot_y',
+            'start_step': start_step,
+            'rank': 1,
+            'label': label,
+        }
+        return self.send_to_plotter(meta, arr)
+
+    def plot_z(self, name, arr, extent=None, start_step=None, xname='X axis',
+    xscale='arb. u.', yname='Y axis', yscale='arb. u.', zname='Y axis', zscale='arb. u.',
+    percentiles=None, relevel_every=None, level_smoothing=None):
+        '''
+        extent is ((initial x, final x), (initial y, final y))
+        start_step is ((initial x, delta x), (initial_y, final_y))
+        percentiles, if given, are the (low, high) percentiles of the pixels autoscaling sets the levels to,
+        rather than their min and max, say (1, 99) to ignore hot pixels
+        relevel_every and level_smoothing make autoscaling slow: it only sets the levels every relevel_every
+        images, and then moves them level_smoothing (0 to 1) of the way to those of the image
+        '''
+        arr = np.asarray(arr)
+        if extent is not None and start_step is not None:
+            raise ValueError('extent and start_step provide the same info and are thus mutually exclusive')
+        if extent is not None:
+            (x0, x1), (y0, y1) = extent
+            nx, ny = arr.shape
+            start_step = (x0, float(x1 - x0)/nx), (y0, float(y1 - y0)/ny)
+        meta = {
+            'name': name,
+            'operation':'plot_z',
+            'rank': 2,
+            'start_step': start_step,
+            'X': xscale,
+            'Y': yscale,
+            'Z': zscale,
+            'Xname': xname,
+            'Yname': yname,
+            'Zname': zname,
+            'percentiles': percentiles,
+            'relevel_every': relevel_every,
+            'level_smoothing': level_smoothing,
+        }
+        return self.send_to_plotter(meta, arr)
+
+    def plot_xy(self, name, xs, ys, label='', xname='X axis', xscale='arb. u.', yname='Y axis', yscale='arb. u.',scatter='False'):
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        arr = self.get_buffer((2,) + xs.shape, np.result_type(xs, ys))
+        arr[0] = xs
+        arr[1] = ys
+        meta = {
+            'name': name,
+            'operation':'plot_xy',
+            'rank': 1,
+            'label': label,
+            'X': xscale,
+            'Y': yscale,
+            'Xname': xname,
+            'Yname': yname,
+            'Scatter':scatter
+        }
+        return self.send_to_plotter(meta, arr)
+
+    def update_y(self, name, arr, offset=0, label=''):
+        '''
+        writes arr into the curve from point offset on, leaving the rest of it as it is
+        '''
+        meta = {
+            'name': name,
+            'operation': 'update_y',
+            'origin': offset,
+            'rank': 1,
+            'label': label,
+        }
+        return self.send_to_plotter(meta, np.asarray(arr))
+
+    def update_z(self, name, arr, offset=(0, 0)):
+        '''
+        writes arr into the image with its first element at offset (row, column), leaving the rest
+        of the image as it is. A 1D arr is a single row.
+        '''
+        arr = np.asarray(arr)
+        if arr.ndim == 1:
+            arr = arr[np.newaxis]
+        meta = {
+            'name': name,
+            'operation': 'update_z',
+            'origin': tuple(offset),
+            'rank': 2,
+        }
+        return self.send_to_plotter(meta, arr)
+
+    def append_y(self, name, point, start_step=(0, 1), label='', xname='X axis', xscale='arb. u.', yname='Y axis', yscale='arb. u.',
+                 max_points=None):
+        '''
+        max_points, if given, keeps only the most recent max_points samples of the curve (scrolling display)
+        '''
+        return self.send_to_plotter({
+            'name': name,
+            'operation': 'append_y',
+            'value': point,
+            'start_step': start_step,
+            'rank': 1,
+            'label': label,
+            'X': xscale,
+            'Y': yscale,
+            'Xname': xname,
+            'Yname': yname,
+            'max_points': max_points,
+        })
+
+    def append_xy(self, name, x, y, label='', max_points=None):
+        return self.send_to_plotter({
+            'name': name,
+            'operation': 'append_xy',
+            'value': (x, y),
+            'rank': 1,
+            'label': label,
+            'max_points': max_points,
+        })
+
+    def append_z(self, name, arr, start_step=None, xname='X axis',
+    xscale='arb. u.', yname='Y axis', yscale='arb. u.', zname='Y axis', zscale='arb. u.', max_rows=None,
+    relevel_every=None, level_smoothing=None):
+        '''
+        max_rows, if given, keeps only the most recent max_rows rows of the image (rolling waterfall)
+        relevel_every and level_smoothing are as for plot_z
+        '''
+        arr = np.asarray(arr)
+        meta = {
+            'name': name,
+            'operation':'append_z',
+            'rank': 2,
+            'start_step': start_step,
+            'X': xscale,
+            'Y': yscale,
+            'Z': zscale,
+            'Xname': xname,
+            'Yname': yname,
+            'Zname': zname,
+            'max_rows': max_rows,
+            'relevel_every': relevel_every,
+            'level_smoothing': level_smoothing,
+            }
+        return self.send_to_plotter(meta, arr)
+
+    def label(self, name, text):
+        return self.send_to_plotter({
+            'name': name,
+            'operation': 'label',
+            'value': text
+        })
+
+    def clear(self, name=None):
+        return self.send_to_plotter({
+            'name': name,
+            'operation': 'clear'
+        })
+
+    def hide(self, name=None):
+        return self.send_to_plotter({
+            'name': name,
+            'operation': 'close'
+        })
+
+    def remove(self, name=None):
+        return self.send_to_plotter({
+            'name': name,
+            'operation': 'remove'
+        })
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import os
+import tempfile
+import warnings
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from . import api, protocol
+
+__author__ = 'phil'
+
+
+class AsyncLivePlotClient(api.PlotAPI):
+    """
+    LivePlotClient for asyncio code, all plotting methods are coroutines:
+
+        async with AsyncLivePlotClient() as plotter:
+            await plotter.plot_y('trace', ys)
+
+    It talks to the window through its Unix domain socket and sends arrays through POSIX
+    shared memory lent by the window, so it needs neither Qt nor a QCoreApplication. Any
+    number of coroutines can plot through one client, waiting for a free shared memory slot
+    only suspends the coroutine that has an array to send.
+    """
+    def __init__(self, timeout=2., size=2**20, slots=2, max_size=2**28, priority=0, weight=1):
+        """
+        timeout is in seconds, size, slots, max_size, priority and weight are as for LivePlotClient
+        """
+        self.timeout = timeout
+        self.priority = priority
+        self.weight = weight
+        self.size = size
+        self.max_size = max(max_size, size)
+        self.slots = slots
+        self.is_connected = False
+        self.writer = None
+        self.shared_mem = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        path = os.path.join(tempfile.gettempdir(), protocol.SERVER)
+        try:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_unix_connection(path), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise EnvironmentError("Couldn't find LivePlotter instance")
+
+        # the window lends us one of its POSIX shared memory segments
+        self.encoder = protocol.Encoder()
+        self.writer.write(self.encoder.encode('hello', ext={'size': self.size, 'slots': self.slots, 'posix': True,
+                                                            'name': protocol.client_name(), 'priority': self.priority,
+                                                            'weight': self.weight}))
+        try:
+            reply = await asyncio.wait_for(self.read_segment(), self.timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            reply = None
+        if reply is None:
+            await self.close()
+            raise EnvironmentError("LivePlotter instance did not lend shared memory")
+        self.attach(reply)
+        self.free_slots = asyncio.Semaphore(self.slots)
+        # held to resize the shared memory or stream an array, which can't be interleaved
+        self.exclusive = asyncio.Lock()
+        self.peak = 0
+        self.arrays_sent = 0
+
+        self.is_connected = True
+        self.ack_reader = asyncio.ensure_future(self.read_acks())
+        return self
+
+    def attach(self, segment):
+        if self.shared_mem is not None:
+            self.region = None
+            self.shared_mem.close()
+        self.shared_mem = shared_memory.SharedMemory(segment['key'][len(protocol.POSIX_PREFIX):])
+        # the window owns it, this process must not unlink it at exit
+        resource_tracker.unregister(self.shared_mem._name, 'shared_memory')
+        self.region = np.frombuffer(self.shared_mem.buf, np.uint8)
+        self.slot_size = protocol.slot_size(self.shared_mem.size, self.slots)
+        self.seq = 0
+
+    async def resize(self, size):
+        """Trades the shared memory for a segment of size bytes, called holding exclusive"""
+        # with every slot taken back the window is done with all of them
+        for _ in range(self.slots):
+            await self.free_slots.acquire()
+        try:
+            if not self.is_connected:
+                return
+            # the answer is read here, not by read_acks
+            self.ack_reader.cancel()
+            try:
+                await self.ack_reader
+            except asyncio.CancelledError:
+                pass
+            self.writer.write(self.encoder.encode('resize', ext={'size': size, 'slots': self.slots, 'posix': True}))
+            try:
+                reply = await asyncio.wait_for(self.read_segment(), self.timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                reply = None
+            if reply is None:
+                self.disconnect_received()
+                return
+            self.attach(reply)
+            self.peak = 0
+            self.ack_reader = asyncio.ensure_future(self.read_acks())
+        finally:
+            for _ in range(self.slots):
+                self.free_slots.release()
+
+    async def read_segment(self):
+        """The key and size of the segment the window answers a hello or resize with, None if it refuses"""
+        ack = await self.reader.readexactly(len(protocol.ACK))
+        if ack != protocol.ACK:
+            return None
+        n, = protocol.LENGTH.unpack(await self.reader.readexactly(protocol.LENGTH.size))
+        return json.loads(await self.reader.readexactly(n))
+
+    async def close(self):
+        if self.is_connected:
+            # as LivePlotClient.wait_for_acks, by taking back every slot
+            try:
+                for _ in range(self.slots):
+                    await asyncio.wait_for(self.free_slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.is_connected = False
+        if self.writer is None:
+            return
+        if getattr(self, 'ack_reader', None) is not None:
+            self.ack_reader.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        self.writer = None
+        # the segment goes back to the window's pool
+        self.region = None
+        if self.shared_mem is not None:
+            self.shared_mem.close()
+            self.shared_mem = None
+
+    async def read_acks(self):
+        """Frees a slot for every ack, slots are acknowledged in the order they were filled"""
+        try:
+            while True:
+                await self.reader.readexactly(len(protocol.ACK))
+                self.free_slots.release()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.disconnect_received()
+
+    async def send_to_plotter(self, meta, arr=None):
+        if not self.is_connected:
+            return
+        if meta["name"] is None:
+            meta["name"] = "*"
+        operation = meta.pop('operation')
+        name = meta.pop('name')
+        label = meta.pop('label', '')
+        value = meta.pop('value', None)
+        array = None
+        if arr is not None:
+            arr = protocol.sendable(arr)
+            if not arr.size:
+                # as LivePlotClient, an empty array goes without a slot
+                arr = None
+        if arr is not None:
+            while True:
+                if arr.nbytes > self.slot_size - protocol.SLOT_HEADER:
+                    async with self.exclusive:
+                        if arr.nbytes > self.slot_size - protocol.SLOT_HEADER and self.shared_mem.size < self.max_size:
+                            await self.resize(min(max(protocol.segment_size(arr.nbytes, self.slots),
+                                                      2*self.shared_mem.size), self.max_size))
+                        if arr.nbytes > self.slot_size - protocol.SLOT_HEADER and self.is_connected:
+                            await self.send_chunked(operation, name, label, meta, value, arr)
+                            return
+                await self.free_slots.acquire()
+                if not self.is_connected:
+                    # pass the wake up on to the next waiting coroutine
+                    self.free_slots.release()
+                    return
+                if arr.nbytes <= self.slot_size - protocol.SLOT_HEADER:
+                    break
+                # the shared memory shrank while this one was waiting
+                self.free_slots.release()
+            # nothing below yields until the frame is written, so frames go out in seq order
+            slot, seq = self.seq % self.slots, self.seq
+            self.seq += 1
+            start = protocol.slot_offset(slot, self.slot_size)
+            dst = self.region[start:start + arr.nbytes].view(arr.dtype.newbyteorder('=')).reshape(arr.shape)
+            dst[...] = arr
+            protocol.SEQ.pack_into(self.region, slot*self.slot_size, seq)
+            array = {'slot': slot, 'seq': seq, 'offset': 0, 'dtype': dst.dtype, 'shape': arr.shape}
+        self.writer.write(self.encoder.encode(operation, name, label, meta, value, array))
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            self.disconnect_received()
+        if arr is not None:
+            await self.track_size(arr.nbytes)
+
+    async def send_chunked(self, operation, name, label, meta, value, arr):
+        """Streams an array too big for a slot as LivePlotClient.send_chunked, called holding exclusive"""
+        data = np.ascontiguousarray(arr, arr.dtype.newbyteorder('=')).reshape(-1).view(np.uint8)
+        capacity = self.slot_size - protocol.SLOT_HEADER
+        for start in range(0, len(data), capacity):
+            piece = data[start:start + capacity]
+            await self.free_slots.acquire()
+            if not self.is_connected:
+                self.free_slots.release()
+                return
+            slot, seq = self.seq % self.slots, self.seq
+            self.seq += 1
+            offset = protocol.slot_offset(slot, self.slot_size)
+            self.region[offset:offset + len(piece)] = piece
+            protocol.SEQ.pack_into(self.region, slot*self.slot_size, seq)
+            if start == 0:
+                array = {'slot': slot, 'seq': seq, 'offset': 0, 'dtype': arr.dtype.newbyteorder('='),
+                         'shape': arr.shape, 'chunked': True}
+                self.writer.write(self.encoder.encode(operation, name, label, meta, value, array))
+            else:
+                array = {'slot': slot, 'seq': seq, 'offset': 0, 'dtype': np.uint8, 'shape': (len(piece),)}
+                self.writer.write(self.encoder.encode('chunk', name, label, array=array))
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                self.disconnect_received()
+
+    async def track_size(self, nbytes):
+        """As LivePlotClient.track_size"""
+        self.peak = max(self.peak, nbytes)
+        self.arrays_sent += 1
+        if self.arrays_sent % protocol.SHRINK_INTERVAL:
+            return
+        size = max(protocol.segment_size(self.peak, self.slots), self.size)
+        if protocol.SHRINK_FACTOR*size <= self.shared_mem.size:
+            async with self.exclusive:
+                await self.resize(size)
+        self.peak = 0
+
+    def disconnect_received(self):
+        if self.is_connected:
+            self.is_connected = False
+            self.free_slots.release()
+            warnings.warn('Disconnected from LivePlotter server, plotting has been disabled')
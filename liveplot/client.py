@@ -1,43 +1,398 @@
 import atexit
+import collections
+import contextlib
 import json
-import uuid
+import threading
 import warnings
 import numpy as np
 import logging
 from PyQt5.QtNetwork import QLocalSocket
 from PyQt5.QtCore import QCoreApplication, QSharedMemory
 import time
+from . import api, protocol
 
 __author__ = 'phil'
 
 logging.root.setLevel(logging.WARNING)
 
-class LivePlotClient(object):
-    def __init__(self, timeout=2000, size=2**28):
+# Backpressure policies of a threaded LivePlotClient, see LivePlotClient.__init__
+POLICIES = ('block', 'drop-oldest', 'coalesce')
+# Operations that replace everything the window shows for their plot and curve,
+# so a queued one is made obsolete by a newer one with the same key.
+COALESCED = ('plot_y', 'plot_xy', 'plot_z', 'label')
+
+
+class SendQueue(object):
+    """
+    Bounded queue between a threaded LivePlotClient and its sender thread. Every item is a
+    list of (meta, arr) operations that are sent together.
+    """
+    def __init__(self, size, policy):
+        self.items = collections.deque()
+        self.size = size
+        self.policy = policy
+        self.unfinished = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, ops):
+        key = None
+        if len(ops) == 1 and ops[0][0]['operation'] in COALESCED:
+            meta = ops[0][0]
+            key = meta['operation'], meta['name'], meta.get('label', '')
+        with self.cond:
+            if self.closed:
+                return
+            if self.policy == 'coalesce' and key is not None:
+                for i, (k, _) in enumerate(self.items):
+                    if k == key:
+                        del self.items[i]
+                        self.unfinished -= 1
+                        self.coalesced += 1
+                        break
+            if self.policy == 'drop-oldest':
+                while len(self.items) >= self.size:
+                    self.items.popleft()
+                    self.unfinished -= 1
+                    self.dropped += 1
+            else:
+                while len(self.items) >= self.size and not self.closed:
+                    self.cond.wait()
+            self.items.append((key, ops))
+            self.unfinished += 1
+            self.cond.notify_all()
+
+    def get(self):
+        """The next item to send, or None once the queue is closed and empty"""
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items:
+                return None
+            _, ops = self.items.popleft()
+            self.cond.notify_all()
+            return ops
+
+    def task_done(self):
+        with self.cond:
+            self.unfinished -= 1
+            self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            while self.unfinished:
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+
+class LivePlotClient(api.PlotAPI):
+    def __init__(self, timeout=2000, size=2**20, slots=2, threaded=False, queue_size=64, policy='block',
+                 max_size=2**28, priority=0, weight=1):
+        """
+        size is the shared memory used to send arrays at first, lent by the window (possibly a
+        bigger segment left by an earlier client). It is split into slots buffers so that the
+        next array can be written while the window is still reading the previous one. When
+        an array doesn't fit a slot the client asks the window for a bigger segment, up to
+        max_size bytes, and streams arrays too big even for that in slot sized chunks. Once
+        the arrays get small again it goes back to a smaller segment, but never below size.
+
+        threaded moves all communication with the window to a background thread: the plotting
+        methods only copy their array, queue the operation and return, so a slow window never
+        stalls the calling script. When queue_size operations are waiting, policy decides:
+        'block' waits for room, 'drop-oldest' discards the oldest queued operation and
+        'coalesce' (always) replaces a queued plot_y, plot_xy, plot_z or label of the same plot
+        and curve with the newer one, waiting for room like 'block' otherwise.
+
+        When several scripts plot at once, the window reads the messages of clients with a
+        higher priority first and shares its time between clients of the same priority in
+        proportion to their weight. A slow-control script can use a higher priority than a
+        camera feed so its points are never stuck behind the camera's images.
+        """
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of %s' % (POLICIES,))
         self.app = QCoreApplication.instance()
         if self.app is None:
             self.app = QCoreApplication([])
+        self.timeout = timeout
+        self.priority = priority
+        self.weight = weight
+        self.min_size = size
+        self.max_size = max(max_size, size)
+        self.is_connected = False
+        self.batching = False
+        self.batch_frames = []
+        self.batch_slot = None
+        self.batch_seq = None
+        self.batch_offset = 0
+        self.queue = None
+        self.queued_batch = None
+        if threaded:
+            self.queue = SendQueue(queue_size, policy)
+            ready = threading.Event()
+            errors = []
+            self.thread = threading.Thread(target=self.run_sender, args=(size, slots, ready, errors),
+                                           name='LivePlotClient sender', daemon=True)
+            self.thread.start()
+            ready.wait()
+            if errors:
+                raise errors[0]
+        else:
+            self.connect(size, slots)
+
+        atexit.register(self.close)
+
+    def connect(self, size, slots):
         self.sock = QLocalSocket()
-        self.sock.connectToServer("LivePlot")
+        self.sock.connectToServer(protocol.SERVER)
         if not self.sock.waitForConnected():
             raise EnvironmentError("Couldn't find LivePlotter instance")
         self.sock.disconnected.connect(self.disconnect_received)
 
-        key = str(uuid.uuid4())
-        self.shared_mem = QSharedMemory(key)
-        if not self.shared_mem.create(size):
-            raise Exception("Couldn't create shared memory %s" % self.shared_mem.errorString())
-        logging.debug('Memory created with key %s and size %s' % (key, self.shared_mem.size()))
-        self.sock.write(key.encode())
+        # the window lends us one of its shared memory segments
+        self.encoder = protocol.Encoder()
+        self.slots = slots
+        self.peak = 0
+        self.arrays_sent = 0
+        self.sock.write(self.encoder.encode('hello', ext={'size': size, 'slots': slots, 'name': protocol.client_name(),
+                                                          'priority': self.priority, 'weight': self.weight}))
         self.sock.waitForBytesWritten()
-
+        self.attach(self.read_segment())
         self.is_connected = True
-        self.timeout = timeout
 
-        atexit.register(self.close)
+    def read_segment(self):
+        """The key and size of the segment the window answers a hello or resize with"""
+        reply = self.read_reply(len(protocol.ACK) + protocol.LENGTH.size)
+        if reply is None or reply[:len(protocol.ACK)] != protocol.ACK:
+            raise EnvironmentError("LivePlotter instance did not lend shared memory")
+        n, = protocol.LENGTH.unpack_from(reply, len(protocol.ACK))
+        return json.loads(self.read_reply(n) or b'{}')
+
+    def attach(self, segment):
+        if getattr(self, 'shared_mem', None) is not None:
+            self.region = None
+            self.shared_mem.detach()
+        self.shared_mem = QSharedMemory(segment.get('key', ''))
+        if not self.shared_mem.attach():
+            raise EnvironmentError("Couldn't attach to shared memory %s" % self.shared_mem.errorString())
+        logging.debug('Memory attached with key %s and size %s' % (segment['key'], self.shared_mem.size()))
+        self.region = np.frombuffer(self.shared_mem.data(), np.uint8)
+        self.slot_size = protocol.slot_size(self.shared_mem.size(), self.slots)
+        self.seq = 0
+        self.in_flight = 0
+
+    def resize(self, size):
+        """Trades the shared memory for a segment of size bytes, once the window is done with all of it"""
+        if self.batch_slot is not None:
+            self.flush_batch()
+        self.wait_for_acks()
+        if not self.is_connected:
+            return
+        self.write(self.encoder.encode('resize', ext={'size': size, 'slots': self.slots}))
+        self.attach(self.read_segment())
+        self.peak = 0
+
+    def read_reply(self, n):
+        """n bytes of the window's answer to the hello, None if they don't come in time"""
+        data = b''
+        while len(data) < n:
+            if not self.sock.bytesAvailable() and not self.sock.waitForReadyRead(self.timeout):
+                return None
+            data += bytes(self.sock.read(n - len(data)))
+        return data
+
+    def run_sender(self, size, slots, ready, errors):
+        """Body of the sender thread of a threaded client, which owns the socket and shared memory"""
+        try:
+            self.connect(size, slots)
+        except Exception as e:
+            errors.append(e)
+            return
+        finally:
+            ready.set()
+        while True:
+            ops = self.queue.get()
+            if ops is None:
+                # the socket belongs to this thread, close it before the thread goes away
+                self.wait_for_acks()
+                self.sock.disconnected.disconnect(self.disconnect_received)
+                self.sock.disconnectFromServer()
+                self.is_connected = False
+                return
+            try:
+                if len(ops) == 1:
+                    self.send(*ops[0])
+                else:
+                    with self.batch():
+                        for meta, arr in ops:
+                            self.send(meta, arr)
+            except Exception:
+                logging.exception('Failed to send to LivePlotter')
+            finally:
+                self.queue.task_done()
+
+    @property
+    def queue_depth(self):
+        """Number of operations waiting for the sender thread of a threaded client"""
+        return len(self.queue) if self.queue is not None else 0
+
+    @property
+    def dropped(self):
+        """Operations discarded by the 'drop-oldest' policy"""
+        return self.queue.dropped if self.queue is not None else 0
+
+    @property
+    def coalesced(self):
+        """Operations replaced by a newer one under the 'coalesce' policy"""
+        return self.queue.coalesced if self.queue is not None else 0
+
+    def flush(self):
+        """Waits until everything plotted so far has been handed to the window"""
+        if self.queue is not None:
+            self.queue.join()
 
     def close(self):
-        self.shared_mem.detach()
+        if self.queue is not None and not self.queue.closed:
+            self.queue.close()
+            self.thread.join()
+        elif self.queue is None:
+            self.wait_for_acks()
+            if self.is_connected:
+                # as run_sender, a socket closed on purpose is no lost window
+                self.sock.disconnected.disconnect(self.disconnect_received)
+                self.sock.disconnectFromServer()
+                self.is_connected = False
+        if hasattr(self, 'shared_mem'):
+            self.shared_mem.detach()
+
+    def wait_for_acks(self):
+        """
+        Waits until the window is done with every array sent. Closing the socket any earlier
+        can make the window's ack fail, and Qt then drops whatever the window has not read yet.
+        """
+        while self.in_flight and self.is_connected:
+            self.collect_acks(block=True)
+
+    def collect_acks(self, block=False):
+        """Free the slots the window is done with, waiting for one if block is set"""
+        while True:
+            n = self.sock.bytesAvailable() // len(protocol.ACK)
+            if n:
+                self.sock.read(n*len(protocol.ACK))
+                self.in_flight -= n
+                return
+            if not block:
+                return
+            if not self.sock.waitForReadyRead(self.timeout) and not self.is_connected:
+                return
+
+    def wait_for_slot(self):
+        self.collect_acks()
+        while self.in_flight >= self.slots and self.is_connected:
+            self.collect_acks(block=True)
+        return self.seq % self.slots
+
+    def reserve_slot(self):
+        """Claims the next free slot for the next sequence number"""
+        slot, seq = self.wait_for_slot(), self.seq
+        protocol.SEQ.pack_into(self.region, slot*self.slot_size, seq)
+        self.seq += 1
+        self.in_flight += 1
+        return slot, seq
+
+    def next_array(self, shape, dtype):
+        """
+        The place in shared memory the next array that is sent will be written to, growing the
+        shared memory if need be, or None if the array is too big for a slot of max_size bytes.
+        """
+        dtype = np.dtype(dtype)
+        arrsize = int(np.prod(shape))*dtype.itemsize
+        capacity = self.slot_size - protocol.SLOT_HEADER
+        if self.batch_slot is not None and protocol.align(self.batch_offset) + arrsize > capacity:
+            self.flush_batch()
+        if arrsize > capacity and self.shared_mem.size() < self.max_size:
+            self.resize(min(max(protocol.segment_size(arrsize, self.slots), 2*self.shared_mem.size()),
+                            self.max_size))
+            capacity = self.slot_size - protocol.SLOT_HEADER
+        if arrsize > capacity:
+            return None
+        if self.batch_slot is not None:
+            slot, offset = self.batch_slot, protocol.align(self.batch_offset)
+        else:
+            slot, offset = self.wait_for_slot(), 0
+        start = protocol.slot_offset(slot, self.slot_size) + offset
+        return self.region[start:start + arrsize].view(dtype).reshape(shape)
+
+    def get_buffer(self, shape, dtype=float):
+        '''
+        Returns an array living in the shared memory slot the next array will be sent from.
+        Filling it in place and passing it to plot_y, plot_z, ... sends it without any copy.
+        The buffer is only valid until the next array is sent.
+        A threaded client copies arrays when they are queued, so there it is an ordinary array.
+        '''
+        buf = self.next_array(shape, dtype) if self.queue is None else None
+        if buf is None:
+            return np.empty(shape, dtype)
+        return buf
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        Collects the calls made in a with block into one message: their arrays share a single
+        shared memory slot and the window applies them all at once, e.g.
+
+            with plotter.batch():
+                for i, ys in enumerate(curves):
+                    plotter.plot_y('dashboard', ys, label=str(i))
+        '''
+        if self.queue is not None and threading.current_thread() is not self.thread:
+            if self.queued_batch is not None:
+                yield
+                return
+            self.queued_batch = []
+            try:
+                yield
+            finally:
+                ops, self.queued_batch = self.queued_batch, None
+                if ops:
+                    self.queue.put(ops)
+            return
+        if self.batching:
+            yield
+            return
+        self.batching = True
+        try:
+            yield
+        finally:
+            self.batching = False
+            self.flush_batch()
+
+    def flush_batch(self):
+        frames, self.batch_frames = b''.join(self.batch_frames), []
+        if not frames:
+            return
+        array = None
+        if self.batch_slot is not None:
+            array = {'slot': self.batch_slot, 'seq': self.batch_seq, 'offset': 0,
+                     'dtype': np.uint8, 'shape': (self.batch_offset,)}
+            self.batch_slot = None
+            self.batch_offset = 0
+        self.write(self.encoder.encode('batch', value=frames, array=array))
+
+    def write(self, frame):
+        self.sock.write(frame)
+        self.sock.flush()
+        while self.sock.bytesToWrite() and self.sock.waitForBytesWritten(self.timeout):
+            pass
 
     def send_to_plotter(self, meta, arr=None):
         if not self.is_connected:
@@ -45,162 +400,83 @@ class LivePlotClient(object):
         if meta["name"] is None:
             meta["name"] = "*";
         if arr is not None:
-            
-            arrbytes = bytearray(arr)
-            arrsize = len(arrbytes)
-            if arrsize > self.shared_mem.size():
-                raise ValueError("Array too big %s > %s" % (arrsize, self.shared_mem.size()))
-            meta['arrsize'] = arrsize
-            meta['dtype'] = str(arr.dtype)
-            meta['shape'] = arr.shape
+            arr = protocol.sendable(arr)
+            if not arr.size:
+                # nothing to put in a slot, the window takes it as no array
+                arr = None
+        if self.queue is None:
+            self.send(meta, arr)
+            return
+        if arr is not None:
+            # the script is free to reuse its array as soon as this returns
+            arr = np.array(arr)
+        if self.queued_batch is not None:
+            self.queued_batch.append((meta, arr))
         else:
-            meta['arrsize'] = 0
-        meta_bytes = json.dumps(meta).ljust(300)
-        if len(meta_bytes) > 300:
-            raise ValueError("meta object is too large (> 200 char)")
+            self.queue.put([(meta, arr)])
 
-        if arr is None:
-            self.sock.write(meta_bytes.encode())
+    def send(self, meta, arr=None):
+        operation = meta.pop('operation')
+        name = meta.pop('name')
+        label = meta.pop('label', '')
+        value = meta.pop('value', None)
+        array = None
+        if arr is not None:
+            dst = self.next_array(arr.shape, arr.dtype.newbyteorder('='))
+            if dst is None:
+                self.send_chunked(operation, name, label, meta, value, arr)
+                return
+            if dst.__array_interface__['data'][0] != arr.__array_interface__['data'][0] or dst.strides != arr.strides:
+                dst[...] = arr
+            if not self.batching:
+                (slot, seq), offset = self.reserve_slot(), 0
+            else:
+                if self.batch_slot is None:
+                    self.batch_slot, self.batch_seq = self.reserve_slot()
+                slot, seq, offset = self.batch_slot, self.batch_seq, protocol.align(self.batch_offset)
+                self.batch_offset = offset + dst.nbytes
+            array = {'slot': slot, 'seq': seq, 'offset': offset, 'dtype': dst.dtype, 'shape': arr.shape}
+        frame = self.encoder.encode(operation, name, label, meta, value, array)
+        if self.batching:
+            self.batch_frames.append(frame)
         else:
-            if not self.sock.bytesAvailable():
-                self.sock.waitForReadyRead()
-            self.sock.read(2)
-            self.shared_mem.lock()
-            self.sock.write(meta_bytes.encode())
-            region = self.shared_mem.data()
-            region[:arrsize] = arrbytes
-            self.shared_mem.unlock()
-
-    def plot_y(self, name, arr, extent=None, start_step=(0, 1), label=''):
-        arr = np.array(arr)
-        if extent is not None and start_step is not None:
-            raise ValueError('extent and start_step provide the same info and are thus mutually exclusive')
-        if extent is not None:
-            x0, x1 = extent
-            nx = len(arr)
-            start_step = x0, float(x1 - x0)/nx
-        meta = {
-            'name': name,
-            'operation':'plot_y',
-            'start_step': start_step,
-            'rank': 1,
-            'label': label,
-        }
-        self.send_to_plotter(meta, arr)
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def plot_z(self, name, arr, extent=None, start_step=None, xname='X axis',
-    xscale='arb. u.', yname='Y axis', yscale='arb. u.', zname='Y axis', zscale='arb. u.'):
-        '''
-        extent is ((initial x, final x), (initial y, final y))
-        start_step is ((initial x, delta x), (initial_y, final_y))
-        '''
-        arr = np.array(arr)
-        if extent is not None and start_step is not None:
-            raise ValueError('extent and start_step provide the same info and are thus mutually exclusive')
-        if extent is not None:
-            (x0, x1), (y0, y1) = extent
-            nx, ny = arr.shape
-            start_step = (x0, float(x1 - x0)/nx), (y0, float(y1 - y0)/ny)
-        meta = {
-            'name': name,
-            'operation':'plot_z',
-            'rank': 2,
-            'start_step': start_step,
-            'X': xscale,
-            'Y': yscale,
-            'Z': zscale,
-            'Xname': xname,
-            'Yname': yname,
-            'Zname': zname,
-        }
-        self.send_to_plotter(meta, arr)
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def plot_xy(self, name, xs, ys, label='', xname='X axis', xscale='arb. u.', yname='Y axis', yscale='arb. u.',scatter='False'):
-        arr = np.array([xs, ys])
-        meta = {
-            'name': name,
-            'operation':'plot_xy',
-            'rank': 1,
-            'label': label,
-            'X': xscale,
-            'Y': yscale,
-            'Xname': xname,
-            'Yname': yname,
-            'Scatter':scatter
-        }
-        self.send_to_plotter(meta, np.array([xs, ys]))
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def append_y(self, name, point, start_step=(0, 1), label='', xname='X axis', xscale='arb. u.', yname='Y axis', yscale='arb. u.'):
-        self.send_to_plotter({
-            'name': name,
-            'operation': 'append_y',
-            'value': point,
-            'start_step': start_step,
-            'rank': 1,
-            'label': label,
-            'X': xscale,
-            'Y': yscale,
-            'Xname': xname,
-            'Yname': yname,
-        })
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def append_xy(self, name, x, y, label=''):
-        self.send_to_plotter({
-            'name': name,
-            'operation': 'append_xy',
-            'value': (x, y),
-            'rank': 1,
-            'label': label,
-        })
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def append_z(self, name, arr, start_step=None, xname='X axis',
-    xscale='arb. u.', yname='Y axis', yscale='arb. u.', zname='Y axis', zscale='arb. u.'):
-        arr = np.array(arr)
-        meta = {
-            'name': name,
-            'operation':'append_z',
-            'rank': 2,
-            'start_step': start_step,
-            'X': xscale,
-            'Y': yscale,
-            'Z': zscale,
-            'Xname': xname,
-            'Yname': yname,
-            'Zname': zname,
-            }
-        self.send_to_plotter(meta, arr)
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def label(self, name, text):
-        self.send_to_plotter({
-            'name': name,
-            'operation': 'label',
-            'value': text
-        })
-        self.send_to_plotter({'name':'none', 'operation':'none'}, np.asarray([0]))
-
-    def clear(self, name=None):
-        self.send_to_plotter({
-            'name': name,
-            'operation': 'clear'
-        })
-
-    def hide(self, name=None):
-        self.send_to_plotter({
-            'name': name,
-            'operation': 'close'
-        })
-
-    def remove(self, name=None):
-        self.send_to_plotter({
-            'name': name,
-            'operation': 'remove'
-        })
+            self.write(frame)
+        if arr is not None:
+            self.track_size(arr.nbytes)
+
+    def send_chunked(self, operation, name, label, meta, value, arr):
+        """
+        Streams an array too big for a slot, see protocol. With two or more slots the window
+        copies out one chunk while the next is being written.
+        """
+        # chunks can't be part of a batch, send what was batched so far first
+        self.flush_batch()
+        data = np.ascontiguousarray(arr, arr.dtype.newbyteorder('=')).reshape(-1).view(np.uint8)
+        capacity = self.slot_size - protocol.SLOT_HEADER
+        for start in range(0, len(data), capacity):
+            piece = data[start:start + capacity]
+            slot = self.wait_for_slot()
+            offset = protocol.slot_offset(slot, self.slot_size)
+            self.region[offset:offset + len(piece)] = piece
+            slot, seq = self.reserve_slot()
+            if start == 0:
+                array = {'slot': slot, 'seq': seq, 'offset': 0, 'dtype': arr.dtype.newbyteorder('='),
+                         'shape': arr.shape, 'chunked': True}
+                self.write(self.encoder.encode(operation, name, label, meta, value, array))
+            else:
+                array = {'slot': slot, 'seq': seq, 'offset': 0, 'dtype': np.uint8, 'shape': (len(piece),)}
+                self.write(self.encoder.encode('chunk', name, label, array=array))
+
+    def track_size(self, nbytes):
+        """Goes back to a smaller segment if the arrays sent lately all fit one, see protocol.SHRINK_FACTOR"""
+        self.peak = max(self.peak, nbytes)
+        self.arrays_sent += 1
+        if self.arrays_sent % protocol.SHRINK_INTERVAL or self.batching:
+            return
+        size = max(protocol.segment_size(self.peak, self.slots), self.min_size)
+        if protocol.SHRINK_FACTOR*size <= self.shared_mem.size():
+            self.resize(size)
+        self.peak = 0
 
     def disconnect_received(self):
             self.is_connected = False
@@ -0,0 +1,175 @@
+import collections
+import mmap
+import tempfile
+import numpy as np
+from . import protocol
+
+__author__ = 'phil'
+
+# Meta data worked out from the array on ingest, worked out again when a frame is shown.
+DERIVED = ('xs', 'lod')
+# Bytes of memory a frame is counted at on top of its array, mostly its meta data. Frames
+# of empty arrays cost that much too and so don't pile up.
+FRAME_OVERHEAD = 1024
+
+
+class Frame(object):
+    """A plot_y or plot_z operation kept by History, its array in memory or in the SpillFile"""
+    __slots__ = 'index', 'meta', 'array', 'offset', 'nbytes', 'dtype', 'shape'
+
+    def __init__(self, index, meta, array):
+        self.index = index
+        self.meta = {key: value for key, value in meta.items() if key not in DERIVED}
+        self.array = array
+        self.offset = None
+        self.nbytes = array.nbytes
+        self.dtype = array.dtype
+        self.shape = array.shape
+
+
+class SpillFile(object):
+    """
+    A temporary file of size bytes, mapped into memory and used as a ring: arrays are written
+    one after the other, ALIGN byte aligned, starting over at the beginning once they reach the
+    end, so every write overwrites the oldest arrays. An empty array takes up a byte, so it
+    is overwritten in turn too.
+    """
+    def __init__(self, size, directory=None):
+        self.size = size
+        self.file = tempfile.TemporaryFile(prefix='liveplot-history-', dir=directory)
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.data = np.frombuffer(self.map, np.uint8)
+        self.head = 0
+        # frames in the file, oldest first
+        self.frames = collections.deque()
+
+    def write(self, frame):
+        """Moves the array of frame into the file, returns the frames it overwrote"""
+        overwritten = []
+        if self.head + max(frame.nbytes, 1) > self.size:
+            # the frames between here and the end are the oldest, they go before those at the start
+            while self.frames and self.frames[0].offset >= self.head:
+                overwritten.append(self.frames.popleft())
+            self.head = 0
+        end = self.head + max(frame.nbytes, 1)
+        while self.frames and self.frames[0].offset < end and self.frames[0].offset + max(self.frames[0].nbytes, 1) > self.head:
+            overwritten.append(self.frames.popleft())
+        self.data[self.head:self.head + frame.nbytes] = np.ascontiguousarray(frame.array).reshape(-1).view(np.uint8)
+        frame.offset, frame.array = self.head, None
+        self.frames.append(frame)
+        self.head = protocol.align(end)
+        return overwritten
+
+    def read(self, frame):
+        """A copy of the array of frame, the file may overwrite it while it is shown"""
+        return self.data[frame.offset:frame.offset + frame.nbytes].view(frame.dtype).reshape(frame.shape).copy()
+
+    def close(self):
+        self.data = None
+        self.frames.clear()
+        try:
+            self.map.close()
+        except BufferError:
+            # a view of it is still around, the map goes with it
+            pass
+        self.file.close()
+
+
+class History(object):
+    """
+    The plot_y and plot_z frames of every plot, numbered per plot in the order they arrived.
+
+    The newest frame of every curve (or image) is the one its plot shows and costs nothing
+    extra. Once a newer one arrives it counts towards memory bytes of frames kept in memory,
+    beyond which the oldest are moved to a SpillFile of spill bytes, if there is one, and
+    dropped once that is full too.
+    """
+    def __init__(self, memory=2**28, spill=0, directory=None):
+        self.memory = memory
+        self.spill = SpillFile(spill, directory) if spill else None
+        # plot name -> curve label -> its frames, oldest first
+        self.plots = {}
+        self.counts = collections.Counter()
+        # frames counted towards memory, oldest first
+        self.in_memory = collections.deque()
+        self.memory_used = 0
+        # plots whose frames changed since the last call of changes
+        self.changed = set()
+
+    def record(self, meta, arr):
+        name, label = meta['name'], meta['label']
+        frames = self.plots.setdefault(name, {}).setdefault(label, collections.deque())
+        if frames:
+            self.in_memory.append(frames[-1])
+            self.memory_used += frames[-1].nbytes + FRAME_OVERHEAD
+        frames.append(Frame(self.counts[name], meta, arr))
+        self.counts[name] += 1
+        self.changed.add(name)
+        while self.memory_used > self.memory:
+            frame = self.in_memory.popleft()
+            self.memory_used -= frame.nbytes + FRAME_OVERHEAD
+            if self.spill is not None and frame.nbytes <= self.spill.size:
+                for old in self.spill.write(frame):
+                    self._drop(old)
+            else:
+                self._drop(frame)
+
+    def _drop(self, frame):
+        # with the older frames of its curve, which can't be shown correctly without it, unless
+        # it went with a newer one already or the plot was forgotten since
+        frames = self.plots.get(frame.meta['name'], {}).get(frame.meta['label'])
+        if not frames or frame not in frames:
+            return
+        while frames.popleft() is not frame:
+            pass
+        self.changed.add(frame.meta['name'])
+
+    def forget(self, name):
+        """Drops the frames of a plot, name '*' drops all of them"""
+        names = list(self.plots) if name == '*' else [name]
+        for name in names:
+            self.plots.pop(name, None)
+            self.counts.pop(name, None)
+            self.changed.discard(name)
+        self.in_memory = collections.deque(frame for frame in self.in_memory if frame.meta['name'] in self.plots)
+        self.memory_used = sum(frame.nbytes + FRAME_OVERHEAD for frame in self.in_memory)
+
+    def span(self, name):
+        """
+        The numbers of the oldest frame from which on every curve of a plot has its frames kept,
+        and of the newest frame, None if there are none
+        """
+        curves = [frames for frames in self.plots.get(name, {}).values() if frames]
+        if not curves:
+            return None
+        return max(frames[0].index for frames in curves), self.counts[name] - 1
+
+    def at(self, name, index):
+        """The (meta, array) of every curve of a plot as it was once frame index had arrived"""
+        shown = []
+        for frames in self.plots.get(name, {}).values():
+            # the last frame of the curve no newer than index
+            lo, hi = 0, len(frames)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if frames[mid].index <= index:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo:
+                frame = frames[lo - 1]
+                arr = frame.array if frame.array is not None else self.spill.read(frame)
+                shown.append((dict(frame.meta), arr))
+        return shown
+
+    def changes(self):
+        """The plots whose frames changed since this was last called"""
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def close(self):
+        self.plots.clear()
+        self.in_memory.clear()
+        if self.spill is not None:
+            self.spill.close()
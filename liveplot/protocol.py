@@ -0,0 +1,283 @@
+import enum
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+__author__ = 'phil'
+
+# Name of the window's local server. On Unix it is a socket in the temp directory.
+SERVER = 'LivePlot'
+# Prefix of the hello key of a client that shares POSIX shared memory (named
+# by the rest of the key) rather than a QSharedMemory.
+POSIX_PREFIX = 'posix:'
+
+# Every message on the socket is a 4 byte little endian length followed by that
+# many bytes of frame. A frame starts with HEADER (protocol version, opcode,
+# flags, plot id, curve id) and continues with, in this order and only where
+# present: an ARRAY descriptor (FLAG_ARRAY), a length prefixed JSON object of
+# extended meta data (FLAG_EXT) and the operation's value.
+#
+# A BATCH frame carries a sequence of complete frames as its value. Their
+# arrays are packed, ALIGN byte aligned, into the one slot named by the BATCH
+# frame's own array descriptor, so the whole batch costs a single ack.
+#
+# An array too big for a slot is streamed: the frame of the operation has
+# FLAG_CHUNKED set and carries as much of the array's bytes as fits a slot, the
+# rest follow in CHUNK frames, one slot each. The operation takes effect once
+# the last of them has arrived, until then the window can show what it has.
+#
+# Plot and curve names are interned: the first time a name is used the client
+# sends a DEFINE frame binding it to an id, later frames only carry the id.
+# Extended meta data (axis names, start_step, ...) is remembered per plot, curve
+# and operation on both ends and only sent again when it changes.
+LENGTH = struct.Struct('<I')
+VERSION = 1
+HEADER = struct.Struct('<BBHII')
+ARRAY = struct.Struct('<IQQ4sB')
+DIM = struct.Struct('<Q')
+FLAG_ARRAY = 1
+FLAG_EXT = 2
+FLAG_CHUNKED = 4
+
+
+class Op(enum.IntEnum):
+    HELLO = 0
+    DEFINE = 1
+    CLEAR = 2
+    CLOSE = 3
+    REMOVE = 4
+    LABEL = 5
+    PLOT_Y = 6
+    PLOT_XY = 7
+    PLOT_Z = 8
+    APPEND_Y = 9
+    APPEND_XY = 10
+    APPEND_Z = 11
+    BATCH = 12
+    CHUNK = 13
+    RESIZE = 14
+    UPDATE_Y = 15
+    UPDATE_Z = 16
+
+# operation names as used by MainWindow.do_operation
+OPERATIONS = {op: op.name.lower() for op in Op}
+OPCODES = {name: op for op, name in OPERATIONS.items()}
+VALUES = {
+    Op.APPEND_Y: struct.Struct('<d'),
+    Op.APPEND_XY: struct.Struct('<dd'),
+}
+
+# The shared memory region is split into equally sized slots used as a ring. A
+# slot starts with a header holding the sequence number of the message written
+# into it; the payload follows at SLOT_HEADER bytes. The window answers every
+# payload message with ACK once it is done with the slot, so slots are freed in
+# the order they were filled.
+SLOT_HEADER = 64
+SEQ = struct.Struct('<Q')
+ACK = b'ok'
+ALIGN = 64
+
+# A client that brings its own shared memory names it by the 'key' of its hello.
+# Otherwise the hello asks for 'size' bytes (and 'posix' memory, for clients
+# without Qt) and the window lends the client one of its own segments: the ACK
+# answering the hello is then followed by a length prefixed JSON object holding
+# the 'key' and 'size' of the segment. Once every slot has been acknowledged a
+# client can trade its segment for one of another size with a RESIZE frame,
+# whose extended meta data is as for the hello and which is answered the same
+# way. Sequence numbers start over at 0 in the new segment.
+#
+# The hello may also give the client's 'name', 'priority' and 'weight', which
+# decide how the window shares its time between clients, see Scheduler.
+#
+# Clients ask for a bigger segment when an array doesn't fit a slot, and for a
+# smaller one when the biggest of their last SHRINK_INTERVAL arrays would fit a
+# segment SHRINK_FACTOR times smaller than theirs.
+SHRINK_INTERVAL = 1024
+SHRINK_FACTOR = 8
+
+# Array dtypes that can be sent. Anything else (objects, strings, ...) has no
+# meaningful plot and is rejected by the client.
+DTYPE_KINDS = 'buifc'
+
+
+def client_name():
+    """Name the window shows for a client, that of the script using it"""
+    return os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python'
+
+
+def sendable(arr):
+    """The array as it is put in shared memory, raises TypeError for arrays that can't be plotted"""
+    if arr.dtype.kind not in DTYPE_KINDS:
+        raise TypeError("Can't plot arrays of dtype %s" % arr.dtype)
+    if arr.dtype.kind == 'b':
+        return arr.view(np.uint8)
+    return arr
+
+
+def slot_size(size, slots):
+    return (size // slots) // SLOT_HEADER * SLOT_HEADER
+
+
+def slot_offset(slot, size):
+    return slot*size + SLOT_HEADER
+
+
+def align(n):
+    return -(-n // ALIGN)*ALIGN
+
+
+def segment_size(nbytes, slots):
+    """The smallest power of two size of a segment whose slots hold nbytes of payload each"""
+    return 1 << (slots*(SLOT_HEADER + align(nbytes)) - 1).bit_length()
+
+
+def segment_reply(key, size):
+    body = json.dumps({'key': key, 'size': size}).encode()
+    return ACK + LENGTH.pack(len(body)) + body
+
+
+def _json_default(obj):
+    # numpy scalars, e.g. an int16 passed as start_step
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+
+def _frame(op, plot_id=0, curve_id=0, flags=0, body=b''):
+    header = HEADER.pack(VERSION, op, flags, plot_id, curve_id)
+    return LENGTH.pack(len(header) + len(body)) + header + body
+
+
+class Encoder(object):
+    """Client side of the protocol: turns operations into frames."""
+    def __init__(self):
+        self.ids = {'': 0}
+        self.ext = {}
+
+    def intern(self, name, frames):
+        if name not in self.ids:
+            self.ids[name] = len(self.ids)
+            frames.append(_frame(Op.DEFINE, self.ids[name], body=name.encode()))
+        return self.ids[name]
+
+    def encode(self, operation, name='', label='', ext=None, value=None, array=None):
+        """
+        array, if given, is a dict with the slot, seq, offset, dtype and shape of the payload,
+        and 'chunked' set if the payload is the first part of a streamed array.
+        Returns the bytes to write, including DEFINE frames for names not seen before.
+        """
+        op = OPCODES[operation]
+        frames = []
+        plot_id = self.intern(name, frames)
+        curve_id = self.intern(label, frames)
+        flags = 0
+        body = []
+        if array is not None:
+            flags |= FLAG_ARRAY
+            if array.get('chunked'):
+                flags |= FLAG_CHUNKED
+            shape = array['shape']
+            body.append(ARRAY.pack(array['slot'], array['seq'], array['offset'],
+                                   np.dtype(array['dtype']).str.encode(), len(shape)))
+            body.extend(DIM.pack(n) for n in shape)
+        key = plot_id, curve_id, op
+        if ext and self.ext.get(key) != ext:
+            self.ext[key] = ext
+            flags |= FLAG_EXT
+            ext_bytes = json.dumps(ext, default=_json_default).encode()
+            body.append(LENGTH.pack(len(ext_bytes)) + ext_bytes)
+        if op in VALUES:
+            body.append(VALUES[op].pack(*np.ravel(value)))
+        elif isinstance(value, bytes):
+            body.append(value)
+        elif value is not None:
+            body.append(str(value).encode())
+        frames.append(_frame(op, plot_id, curve_id, flags, b''.join(body)))
+        return b''.join(frames)
+
+
+class Decoder(object):
+    """Window side of the protocol: turns frames back into meta data dicts."""
+    def __init__(self):
+        self.names = {0: ''}
+        self.ext = {}
+
+    def decode(self, frame):
+        """Returns the meta data of the frame, or None for frames that only update the decoder"""
+        version, op, flags, plot_id, curve_id = HEADER.unpack_from(frame)
+        if version != VERSION:
+            raise ValueError('Unsupported protocol version %s' % version)
+        op = Op(op)
+        pos = HEADER.size
+        if op == Op.DEFINE:
+            self.names[plot_id] = bytes(frame[pos:]).decode()
+            return None
+        meta = {
+            'operation': OPERATIONS[op],
+            'name': self.names[plot_id],
+            'label': self.names[curve_id],
+            'arrsize': 0,
+        }
+        if flags & FLAG_ARRAY:
+            slot, seq, offset, dtype, ndim = ARRAY.unpack_from(frame, pos)
+            pos += ARRAY.size
+            shape = [DIM.unpack_from(frame, pos + i*DIM.size)[0] for i in range(ndim)]
+            pos += ndim*DIM.size
+            dtype = np.dtype(dtype.rstrip(b'\0').decode())
+            meta.update(slot=slot, seq=seq, offset=offset, dtype=dtype, shape=shape,
+                        arrsize=int(np.prod(shape))*dtype.itemsize, chunked=bool(flags & FLAG_CHUNKED))
+        key = plot_id, curve_id, op
+        if flags & FLAG_EXT:
+            n, = LENGTH.unpack_from(frame, pos)
+            pos += LENGTH.size
+            self.ext[key] = json.loads(bytes(frame[pos:pos + n]).decode())
+            pos += n
+        meta.update(self.ext.get(key, {}))
+        if op in VALUES:
+            value = VALUES[op].unpack_from(frame, pos)
+            meta['value'] = value[0] if len(value) == 1 else value
+        elif op == Op.LABEL:
+            meta['value'] = bytes(frame[pos:]).decode()
+        elif op == Op.BATCH:
+            meta['value'] = bytes(frame[pos:])
+        return meta
+
+
+class FrameReader(object):
+    """
+    Accumulates bytes read from a socket and splits them into complete frames,
+    so a message is only decoded once all of it has arrived.
+    """
+    def __init__(self):
+        self.bytes = bytearray()
+        # number of complete frames in bytes, and where the first incomplete one starts
+        self.complete = 0
+        self.scanned = 0
+
+    def feed(self, data):
+        self.bytes.extend(data)
+        while self.scanned + LENGTH.size <= len(self.bytes):
+            end = self.scanned + LENGTH.size + LENGTH.unpack_from(self.bytes, self.scanned)[0]
+            if end > len(self.bytes):
+                break
+            self.scanned = end
+            self.complete += 1
+
+    def ready(self):
+        """Whether a complete frame is waiting to be read"""
+        return self.complete > 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.complete:
+            raise StopIteration
+        end = LENGTH.size + LENGTH.unpack_from(self.bytes)[0]
+        frame = bytes(self.bytes[LENGTH.size:end])
+        del self.bytes[:end]
+        self.scanned -= end
+        self.complete -= 1
+        return frame
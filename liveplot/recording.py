@@ -0,0 +1,192 @@
+import array
+import collections
+import itertools
+import mmap
+import struct
+import time
+import weakref
+import numpy as np
+from . import protocol
+
+__author__ = 'phil'
+
+# A session file starts with MAGIC, padded to ALIGN bytes, and continues with a
+# record of every message the window read: a RECORD header (seconds since the
+# recording started, client number, slot size of the client, frame and payload
+# length), the frame as it came off the socket and, ALIGN byte aligned, its
+# payload, the part of the message's slot in use. Records start ALIGN byte
+# aligned too. Closing the recording appends an index, the times and then the
+# offsets of all records, and a TRAILER telling where it starts. A session that
+# wasn't closed is indexed by reading it through.
+MAGIC = b'LivePlot session'
+RECORD = struct.Struct('<dIQIQ')
+TRAILER = struct.Struct('<QQ16s')
+
+
+class Recorder(object):
+    """Appends the messages the window reads to a session file"""
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.pad()
+        self.start = time.perf_counter()
+        self.clients = weakref.WeakKeyDictionary()
+        self.numbers = itertools.count()
+        self.times = array.array('d')
+        self.offsets = array.array('Q')
+
+    def pad(self):
+        position = self.file.tell()
+        self.file.write(bytes(protocol.align(position) - position))
+
+    def record(self, client, frame, meta):
+        """Appends a message of client, meta is the frame decoded, None for a DEFINE"""
+        if client not in self.clients:
+            self.clients[client] = next(self.numbers)
+        payload = client.used(meta) if meta is not None and meta['arrsize'] else b''
+        now = time.perf_counter() - self.start
+        self.times.append(now)
+        self.offsets.append(self.file.tell())
+        self.file.write(RECORD.pack(now, self.clients[client], client.slot_size, len(frame), len(payload)))
+        self.file.write(frame)
+        if len(payload):
+            self.pad()
+            self.file.write(payload)
+        self.pad()
+
+    def close(self):
+        if self.file.closed:
+            return
+        index = self.file.tell()
+        self.file.write(self.times.tobytes())
+        self.file.write(self.offsets.tobytes())
+        self.file.write(TRAILER.pack(index, len(self.times), MAGIC))
+        self.file.close()
+
+
+class Recording(object):
+    """
+    A session file mapped into memory. Frames and payloads are handed out as views of the
+    map, the window copies arrays out of them as out of a client's shared memory.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = np.frombuffer(self.map, np.uint8)
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise ValueError('%s is not a LivePlot session' % path)
+        index, count, magic = TRAILER.unpack_from(self.map, len(self.data) - TRAILER.size) \
+            if len(self.data) >= protocol.align(len(MAGIC)) + TRAILER.size else (0, 0, b'')
+        if magic == MAGIC:
+            self.times = self.data[index:index + 8*count].view('<f8')
+            self.offsets = self.data[index + 8*count:index + 16*count].view('<u8')
+        else:
+            self.times, self.offsets = self.scan()
+
+    def scan(self):
+        """The times and offsets of the complete records of a session that wasn't closed"""
+        times, offsets = array.array('d'), array.array('Q')
+        position = protocol.align(len(MAGIC))
+        while position + RECORD.size <= len(self.data):
+            now, _, _, frame_length, payload_length = RECORD.unpack_from(self.map, position)
+            end = position + RECORD.size + frame_length
+            if payload_length:
+                end = protocol.align(end) + payload_length
+            if frame_length < protocol.HEADER.size or end > len(self.data):
+                break
+            times.append(now)
+            offsets.append(position)
+            position = protocol.align(end)
+        return np.frombuffer(times, '<f8'), np.frombuffer(offsets, '<u8')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        """The time, client number, slot size, frame and payload of message i"""
+        position = int(self.offsets[i])
+        now, client, slot_size, frame_length, payload_length = RECORD.unpack_from(self.map, position)
+        start = position + RECORD.size
+        frame = self.data[start:start + frame_length]
+        start = protocol.align(start + frame_length)
+        return now, client, slot_size, frame, self.data[start:start + payload_length]
+
+    def index_at(self, seconds):
+        """The first message recorded no earlier than seconds into the session"""
+        return int(np.searchsorted(self.times, seconds))
+
+    def start_at(self, index):
+        """
+        Where to play from to show the session from message index on: there, or where an array
+        still being streamed at index started. Returns that and the clients as they were before it.
+        """
+        clients = self.clients_at(index)
+        start = min([index] + [client.stream_start for client in clients.values() if client.stream_start is not None])
+        if start < index:
+            clients = self.clients_at(start)
+        return start, clients
+
+    def clients_at(self, index):
+        """The RecordedClients of the session with the names and meta data they had defined before message index"""
+        clients = collections.defaultdict(RecordedClient)
+        for i in range(min(index, len(self))):
+            _, number, slot_size, frame, _ = self[i]
+            client = clients[number]
+            meta = client.decoder.decode(frame)
+            if meta is None:
+                continue
+            if meta['operation'] == 'chunk':
+                client.stream_left -= meta['arrsize']
+            elif meta.get('chunked'):
+                client.stream_start = i
+                client.stream_left = meta['arrsize'] - min(meta['arrsize'], slot_size - protocol.SLOT_HEADER)
+            if client.stream_left <= 0:
+                client.stream_start = None
+        return clients
+
+    def close(self):
+        self.data = self.times = self.offsets = None
+        try:
+            self.map.close()
+        except BufferError:
+            # a view of it is still around, the map goes with it
+            pass
+        self.file.close()
+
+
+class RecordedClient(object):
+    """
+    Stands in for a recorded client when its messages are played back: the slot of a message
+    is its recorded payload, which needs no acknowledgement.
+    """
+    def __init__(self):
+        self.decoder = protocol.Decoder()
+        # as for Client
+        self.jobs = collections.deque()
+        self.stream = None
+        self.dropped = False
+        self.slot_size = 0
+        self.slot = None
+        # where the array being streamed started in the recording, and how much of it is missing
+        self.stream_start = None
+        self.stream_left = 0
+
+    def play(self, slot_size, payload):
+        """Makes payload the slot of the next message"""
+        self.slot_size = slot_size
+        self.slot = payload
+
+    def check_slot(self, meta):
+        pass
+
+    def array(self, meta):
+        return self.slot[meta['offset']:meta['offset'] + meta['arrsize']].view(meta['dtype']).reshape(meta['shape'])
+
+    def payload(self, meta, n):
+        return self.slot[meta['offset']:meta['offset'] + n]
+
+    def used(self, meta):
+        return self.slot
+
+    def ack(self):
+        pass
@@ -1,11 +1,49 @@
-from PyQt5 import QtWidgets, QtCore
+from PyQt5 import QtWidgets, QtCore, QtGui
+import collections
 import warnings
+import weakref
 import pyqtgraph as pg
 import numpy as np
 from pyqtgraph.dockarea import Dock
 
 pg.setConfigOption('background', (24,25,26))
 
+# Curves with at least LOD_POINTS points are drawn as a min/max envelope of
+# the visible range, with one bin per pixel but at least LOD_MIN_BINS.
+LOD_POINTS = 2**15
+LOD_MIN_BINS = 500
+# Images with at least TILED_PIXELS pixels are drawn from an ImagePyramid.
+TILED_PIXELS = 2**22
+# Autoscaled levels are worked out from at most LEVELS_SAMPLE pixels of an
+# image. Slow autoscaling moves the levels SLOW_LEVELS of the way to those of
+# each new image, unless told otherwise.
+LEVELS_SAMPLE = 10**6
+SLOW_LEVELS = 0.1
+
+def image_levels(image, percentiles=None):
+    """
+    The levels autoscaling picks for image: the min and max, or the (low, high) percentiles,
+    of every other pixel along its longest axis until no more than LEVELS_SAMPLE are left, as
+    pyqtgraph's autoscaling does. None if the image has no finite levels.
+    """
+    sample = np.asarray(image)
+    if not sample.size:
+        return None
+    while sample.size > LEVELS_SAMPLE:
+        axis = int(np.argmax(sample.shape))
+        sample = sample[(slice(None),)*axis + (slice(None, None, 2),)]
+    if percentiles is not None:
+        with warnings.catch_warnings():
+            # all NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            levels = np.nanpercentile(sample, percentiles)
+    else:
+        levels = np.fmin.reduce(sample, axis=None), np.fmax.reduce(sample, axis=None)
+    if not np.all(np.isfinite(levels)):
+        return None
+    return float(levels[0]), float(levels[1])
+
+
 def get_widget(rank, name):
     return {
         1: CrosshairDock,
@@ -14,8 +52,12 @@ def get_widget(rank, name):
 
 class CloseableDock(Dock):
     docklist = []
+    # the frame of the plot's history the slider was moved to, see set_history
+    scrubbed = QtCore.pyqtSignal(int)
+
     def __init__(self, *args, **kwargs):
         super(CloseableDock, self).__init__(*args, **kwargs)
+        self.history_slider = None
         style = QtWidgets.QStyleFactory().create("windows")
         close_icon = style.standardIcon(QtWidgets.QStyle.SP_TitleBarCloseButton)
         close_button = QtWidgets.QPushButton(close_icon, "", self)
@@ -40,6 +82,34 @@ class CloseableDock(Dock):
             if self._container is not self.area.topContainer:
                 self._container.apoptose()
 
+    def set_history(self, first, last, live=True):
+        """
+        Lets the slider below the plot scrub through frames first to last of its history, once
+        there are two of them. If live the slider follows the newest frame, otherwise it stays
+        at its frame for as long as that is kept.
+        """
+        slider = self.history_slider
+        if slider is None:
+            if last <= first:
+                return
+            slider = self.history_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+            slider.setToolTip('Earlier frames of the plot, all the way right follows the new ones')
+            slider.valueChanged.connect(self.scrubbed)
+            self.addWidget(slider)
+        value = slider.value()
+        slider.blockSignals(True)
+        slider.setRange(first, last)
+        if live:
+            slider.setValue(last)
+        slider.blockSignals(False)
+        if not live and slider.value() != value:
+            # its frame was dropped
+            self.scrubbed.emit(slider.value())
+
+    def render(self):
+        """Draws what was added since the last frame, called on MainWindow's frame timer"""
+        pass
+
     def maximize(self):
         for d in CloseableDock.docklist:
             if d is not self and not d.closed:
@@ -54,6 +124,8 @@ class CrosshairPlotWidget(pg.PlotWidget):
         self.parametric = parametric
         self.search_mode = True
         self.label = None
+        # PointGrid of every parametric curve searched, until its data changes
+        self.point_grids = weakref.WeakKeyDictionary()
 
     def toggle_search(self, mouse_event):
         if mouse_event.double():
@@ -72,20 +144,28 @@ class CrosshairPlotWidget(pg.PlotWidget):
             vb = item.getViewBox()
             view_coords = vb.mapSceneToView(mouse_event)
             view_x, view_y = view_coords.x(), view_coords.y()
+            # distances are measured in screen pixels
+            px, py = vb.viewPixelSize()
 
             best_guesses = []
             for data_item in item.items:
                 if isinstance(data_item, pg.PlotDataItem):
                     xdata, ydata = data_item.xData, data_item.yData
-                    index_distance = lambda i: (xdata[i]-view_x)**2 + (ydata[i] - view_y)**2
+                    if xdata is None or not len(xdata):
+                        continue
                     if self.parametric:
-                        index = min(list(range(len(xdata))), key=index_distance)
+                        grid = self.point_grids.get(data_item)
+                        if grid is None or grid.xs is not xdata or grid.ys is not ydata:
+                            grid = self.point_grids[data_item] = PointGrid(xdata, ydata)
+                        index = grid.nearest(view_x, view_y, px, py)
+                        if index is None:
+                            continue
                     else:
                         index = min(np.searchsorted(xdata, view_x), len(xdata)-1)
                         if index and xdata[index] - view_x > view_x - xdata[index - 1]:
                             index -= 1
                     pt_x, pt_y = xdata[index], ydata[index]
-                    best_guesses.append(((pt_x, pt_y), index_distance(index)))
+                    best_guesses.append(((pt_x, pt_y), ((pt_x - view_x)/px)**2 + ((pt_y - view_y)/py)**2))
 
             if not best_guesses:
                 return
@@ -112,6 +192,530 @@ class CrosshairPlotWidget(pg.PlotWidget):
         self.removeItem(self.v_line)
         self.cross_section_enabled = False
 
+class PointGrid(object):
+    """
+    Uniform grid over the points of a curve, for finding the point nearest to
+    the mouse without looking at all of them. Points are sorted by cell, cells
+    are numbered column by column, so the points of a column of cells in a
+    range of rows are one slice of order. Built once per curve data.
+    """
+    PER_CELL = 4
+
+    def __init__(self, xs, ys):
+        self.xs, self.ys = xs, ys
+        points = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+        self.size = max(int(np.sqrt(len(points) / self.PER_CELL)), 1)
+        if len(points):
+            self.x0, self.y0 = xs[points].min(), ys[points].min()
+            self.width = (xs[points].max() - self.x0) / self.size or 1.
+            self.height = (ys[points].max() - self.y0) / self.size or 1.
+        else:
+            self.x0, self.y0, self.width, self.height = 0., 0., 1., 1.
+        cells = self.column(xs[points])*self.size + self.row(ys[points])
+        order = np.argsort(cells, kind='stable')
+        self.order = points[order]
+        self.sorted_xs, self.sorted_ys = xs[self.order], ys[self.order]
+        self.starts = np.searchsorted(cells[order], np.arange(self.size**2 + 1))
+
+    def column(self, x):
+        return np.clip(((x - self.x0) / self.width).astype(int), 0, self.size - 1)
+
+    def row(self, y):
+        return np.clip(((y - self.y0) / self.height).astype(int), 0, self.size - 1)
+
+    def nearest(self, x, y, sx=1., sy=1.):
+        """
+        Index of the point nearest to (x, y), with x distances measured in units of sx and
+        y distances in units of sy, or None if there are no finite points.
+        """
+        if not len(self.order):
+            return None
+        col, row = int(self.column(np.float64(x))), int(self.row(np.float64(y)))
+        r = 0
+        while True:
+            # search the block of cells r cells around (col, row)
+            c0, c1 = max(col - r, 0), min(col + r, self.size - 1)
+            r0, r1 = max(row - r, 0), min(row + r, self.size - 1)
+            if 4*(c1 - c0 + 1)*(r1 - r0 + 1) > self.size**2:
+                # far from the points, looking at all of them is quicker
+                distances = ((self.sorted_xs - x)/sx)**2 + ((self.sorted_ys - y)/sy)**2
+                return self.order[np.argmin(distances)]
+            found = np.concatenate([self.order[self.starts[c*self.size + r0]:self.starts[c*self.size + r1 + 1]]
+                                    for c in range(c0, c1 + 1)])
+            # points outside the block are at least as far as the nearest of its inner edges
+            edges = []
+            if c0 > 0:
+                edges.append((x - self.x0 - c0*self.width) / sx)
+            if c1 < self.size - 1:
+                edges.append((self.x0 + (c1 + 1)*self.width - x) / sx)
+            if r0 > 0:
+                edges.append((y - self.y0 - r0*self.height) / sy)
+            if r1 < self.size - 1:
+                edges.append((self.y0 + (r1 + 1)*self.height - y) / sy)
+            if len(found):
+                distances = ((self.xs[found] - x)/sx)**2 + ((self.ys[found] - y)/sy)**2
+                best = np.argmin(distances)
+                if not edges or distances[best] <= min(edges)**2:
+                    return found[best]
+            r = 2*r or 1
+
+
+class CurveBuffer(object):
+    """
+    Preallocated storage for a curve that is built up one point at a time.
+
+    The live points always occupy a contiguous slice of the backing arrays, so
+    xs/ys are views that can be handed to pyqtgraph without copying. Capacity
+    doubles when full, giving amortized O(1) appends. If max_points is set only
+    the last max_points samples are kept (scrolling mode); the backing arrays
+    are then 2*max_points long and the live points are moved to the front of
+    new ones once every max_points appends. Old arrays are never written again,
+    the curve may still be showing a view of them until the next frame.
+    """
+    def __init__(self, max_points=None, capacity=256):
+        self.max_points = max_points
+        if max_points is not None:
+            capacity = 2*max_points
+        self._xs = np.empty(capacity)
+        self._ys = np.empty(capacity)
+        self.start = 0
+        self.stop = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def xs(self):
+        return self._xs[self.start:self.stop]
+
+    @property
+    def ys(self):
+        return self._ys[self.start:self.stop]
+
+    def set_max_points(self, max_points):
+        if max_points == self.max_points:
+            return
+        self.max_points = max_points
+        if max_points is not None and len(self) > max_points:
+            self.start = self.stop - max_points
+        self._reallocate(len(self))
+
+    def extend(self, xs, ys):
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        if self.max_points is not None:
+            xs, ys = xs[-self.max_points:], ys[-self.max_points:]
+            n = min(len(self) + len(ys), self.max_points) - len(ys)
+            self.start = self.stop - n
+        if self.stop + len(ys) > len(self._ys):
+            self._reallocate(2*(len(self) + len(ys)))
+        self._xs[self.stop:self.stop + len(ys)] = xs
+        self._ys[self.stop:self.stop + len(ys)] = ys
+        self.stop += len(ys)
+        self.count += len(ys)
+
+    def append(self, x, y):
+        if self.stop == len(self._ys):
+            self._make_room()
+        self._xs[self.stop] = x
+        self._ys[self.stop] = y
+        self.stop += 1
+        self.count += 1
+        if self.max_points is not None and len(self) > self.max_points:
+            self.start += 1
+
+    def _make_room(self):
+        if 2*len(self) > len(self._ys):
+            self._reallocate(2*len(self._ys))
+        else:
+            self._reallocate(len(self._ys))
+
+    def _reallocate(self, capacity):
+        if self.max_points is not None:
+            capacity = 2*self.max_points
+        n = len(self)
+        xs, ys = np.empty(max(capacity, 1)), np.empty(max(capacity, 1))
+        xs[:n] = self.xs
+        ys[:n] = self.ys
+        self._xs, self._ys = xs, ys
+        self.start, self.stop = 0, n
+
+
+class MinMaxPyramid(object):
+    """
+    Min/max envelope of a curve at successively coarser resolutions: level k
+    holds one (min, max) pair per FACTOR**(k+1) points. Drawing the envelope at
+    about one bin per pixel costs the same however long the curve is and, unlike
+    subsampling, never loses a peak. When points are appended only the last bin
+    of every level is recomputed.
+    """
+    FACTOR = 8
+
+    def __init__(self):
+        self.n = 0
+        self.monotonic = True
+        # per level, arrays with spare capacity and the number of bins in use
+        self.mins = []
+        self.maxs = []
+        self.sizes = []
+
+    def update(self, xs, ys, keep=0):
+        """Brings the pyramid up to date with xs, ys, of which the first keep points are unchanged"""
+        keep = min(keep, self.n)
+        if keep == 0:
+            self.monotonic = True
+        self.monotonic = self.monotonic and bool(np.all(np.diff(xs[max(keep - 1, 0):]) >= 0))
+        src_min = src_max = ys
+        start = keep
+        level = 0
+        while len(src_min) > self.FACTOR:
+            first = start // self.FACTOR
+            size = -(-len(src_min) // self.FACTOR)
+            bins = np.arange(first*self.FACTOR, len(src_min), self.FACTOR)
+            if level == len(self.mins):
+                self.mins.append(np.empty(0))
+                self.maxs.append(np.empty(0))
+                self.sizes.append(0)
+            if size > len(self.mins[level]):
+                capacity = max(size, 2*len(self.mins[level]))
+                for levels in self.mins, self.maxs:
+                    grown = np.empty(capacity)
+                    grown[:first] = levels[level][:first]
+                    levels[level] = grown
+            self.mins[level][first:size] = np.minimum.reduceat(src_min, bins)
+            self.maxs[level][first:size] = np.maximum.reduceat(src_max, bins)
+            self.sizes[level] = size
+            src_min, src_max = self.mins[level][:size], self.maxs[level][:size]
+            start = first
+            level += 1
+        del self.mins[level:], self.maxs[level:], self.sizes[level:]
+        self.n = len(ys)
+
+    def refresh(self, ys, i0, i1):
+        """Brings the pyramid up to date after ys[i0:i1] were changed in place"""
+        src_min = src_max = ys
+        for level in range(len(self.mins)):
+            if i1 <= i0:
+                return
+            i0, i1 = i0 // self.FACTOR, -(-i1 // self.FACTOR)
+            start, stop = i0*self.FACTOR, min(i1*self.FACTOR, len(src_min))
+            bins = np.arange(0, stop - start, self.FACTOR)
+            self.mins[level][i0:i1] = np.minimum.reduceat(src_min[start:stop], bins)
+            self.maxs[level][i0:i1] = np.maximum.reduceat(src_max[start:stop], bins)
+            src_min, src_max = self.mins[level][:self.sizes[level]], self.maxs[level][:self.sizes[level]]
+
+    def envelope(self, xs, ys, i0, i1, bins):
+        """The points to draw for xs[i0:i1], ys[i0:i1], at most 2*bins of them unless the curve is short"""
+        level, size = -1, 1
+        while (i1 - i0) // size > bins and level + 1 < len(self.mins):
+            level += 1
+            size *= self.FACTOR
+        if level < 0:
+            return xs[i0:i1], ys[i0:i1]
+        b0, b1 = i0 // size, min(-(-i1 // size), self.sizes[level])
+        # every bin is drawn as a vertical stroke from its min to its max
+        x = xs[np.arange(b0, b1)*size]
+        y = np.empty(2*(b1 - b0))
+        y[0::2] = self.mins[level][b0:b1]
+        y[1::2] = self.maxs[level][b0:b1]
+        return np.repeat(x, 2), y
+
+
+class ImageBuffer(object):
+    """
+    Preallocated storage for an image that is built up one row at a time.
+
+    Works like CurveBuffer: rows live in a contiguous slice of a backing array
+    whose capacity doubles when full, or, if max_rows is set, which keeps only
+    the newest max_rows rows (rolling waterfall). Alongside the data it keeps
+    the ARGB colors of every row that has already been rendered and the min/max
+    of each row, so neither has to be recomputed over the whole image when a
+    row is added.
+    """
+    def __init__(self, width, dtype, max_rows=None, capacity=64):
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.max_rows = max_rows
+        if max_rows is not None:
+            capacity = 2*max_rows
+        self._allocate(capacity)
+        self.start = 0
+        self.stop = 0
+        self.colored = 0
+        self.has_nans = False
+
+    def _allocate(self, capacity):
+        self._data = np.empty((capacity, self.width), self.dtype)
+        self._colors = np.empty((capacity, self.width, 4), np.ubyte)
+        self._mins = np.empty(capacity)
+        self._maxs = np.empty(capacity)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def rows(self):
+        return self._data[self.start:self.stop]
+
+    @property
+    def colors(self):
+        return self._colors[self.start:self.stop]
+
+    def levels(self):
+        if not len(self):
+            return 0, 1
+        mins, maxs = self._mins[self.start:self.stop], self._maxs[self.start:self.stop]
+        if self.has_nans:
+            return np.nanmin(mins), np.nanmax(maxs)
+        return mins.min(), maxs.max()
+
+    def append(self, row):
+        if self.stop == len(self._data):
+            self._make_room()
+        self._data[self.stop] = row
+        if len(row):
+            self._mins[self.stop] = np.min(row)
+            self._maxs[self.stop] = np.max(row)
+            self.has_nans |= bool(np.isnan(self._mins[self.stop]))
+        else:
+            self._mins[self.stop] = np.inf
+            self._maxs[self.stop] = -np.inf
+        self.stop += 1
+        if self.max_rows is not None and len(self) > self.max_rows:
+            self.start += 1
+            self.colored = max(self.colored, self.start)
+
+    def recolor(self):
+        self.colored = self.start
+
+    def _make_room(self):
+        n = len(self)
+        colored = self.colored - self.start
+        old = self._data, self._colors, self._mins, self._maxs
+        # into new arrays, as for CurveBuffer
+        if self.max_rows is None and 2*n > len(self._data):
+            self._allocate(2*len(self._data))
+        else:
+            self._allocate(len(self._data))
+        for src, dst in zip(old, (self._data, self._colors, self._mins, self._maxs)):
+            dst[:n] = src[self.start:self.stop]
+        self.start, self.stop, self.colored = 0, n, colored
+
+
+class ImagePyramid(object):
+    """
+    Mipmaps of a large image, cut into TILE x TILE tiles. Level k is the image
+    averaged over 2**k x 2**k pixel blocks. Levels are computed the first time
+    they are drawn and colored tiles are cached, at most MAX_TILES of them, so
+    panning, zooming or changing the levels only colors the tiles in view.
+    """
+    TILE = 512
+    MAX_TILES = 256
+
+    def __init__(self, image):
+        self.image = image
+        self.mipmaps = [image]
+        # the coarsest level fits in a single tile
+        self.top = max(int(np.ceil(np.log2(max(image.shape) / float(self.TILE)))), 0)
+        self.tiles = collections.OrderedDict()
+        self.color_key = None
+
+    def level(self, k):
+        while len(self.mipmaps) <= k:
+            self.mipmaps.append(pg.functions.downsample(self.mipmaps[-1], 2, axis=(0, 1)))
+        return self.mipmaps[k]
+
+    def update(self, xs, ys):
+        """Brings the levels computed so far and the cached tiles up to date after image[xs, ys] was changed in place"""
+        (x0, x1, _), (y0, y1, _) = xs.indices(self.image.shape[0]), ys.indices(self.image.shape[1])
+        regions = [(x0, x1, y0, y1)]
+        for k in range(1, len(self.mipmaps)):
+            nx, ny = self.mipmaps[k].shape
+            x0, x1, y0, y1 = x0 // 2, min(-(-x1 // 2), nx), y0 // 2, min(-(-y1 // 2), ny)
+            if x1 <= x0 or y1 <= y0:
+                # only the odd row or column the level leaves out was changed
+                break
+            block = np.ascontiguousarray(self.mipmaps[k - 1][2*x0:2*x1, 2*y0:2*y1])
+            self.mipmaps[k][x0:x1, y0:y1] = pg.functions.downsample(block, 2, axis=(0, 1))
+            regions.append((x0, x1, y0, y1))
+        for k, i, j in list(self.tiles):
+            if k < len(regions):
+                x0, x1, y0, y1 = regions[k]
+                if i*self.TILE < x1 and x0 < (i + 1)*self.TILE and j*self.TILE < y1 and y0 < (j + 1)*self.TILE:
+                    del self.tiles[k, i, j]
+
+    def tile(self, k, i, j, lut, levels, color_key):
+        """Tile (i, j) of level k as a QImage, rows along the image's second axis"""
+        if color_key != self.color_key:
+            self.color_key = color_key
+            self.tiles.clear()
+        key = k, i, j
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        data = self.level(k)[i*self.TILE:(i + 1)*self.TILE, j*self.TILE:(j + 1)*self.TILE]
+        argb, _ = pg.functions.makeARGB(data.T, lut=lut, levels=levels)
+        qimage = self.tiles[key] = pg.functions.ndarray_to_qimage(argb, QtGui.QImage.Format_ARGB32)
+        if len(self.tiles) > self.MAX_TILES:
+            self.tiles.popitem(last=False)
+        return qimage
+
+
+class RowImageItem(pg.ImageItem):
+    """
+    ImageItem that can redraw incrementally when its image is an ImageBuffer.
+
+    Rows already colored with the current levels and lookup table are reused
+    from the buffer, so appending a row only runs that row through makeARGB.
+    Plain images of TILED_PIXELS or more are painted tile by tile from an
+    ImagePyramid, at the level matching the screen resolution. Once part of an
+    image is changed in place (update_region) only that part is colored again.
+    Anything else (downsampling, NaNs in a buffer, smaller arrays) falls back
+    to the full pyqtgraph render.
+    """
+    def __init__(self, *args, **kwargs):
+        # setImage may already be called by ImageItem.__init__
+        self.pyramid = None
+        self.buffer = None
+        self._color_key = None
+        # ARGB colors of an image changed in place, and the parts of it (slices
+        # of its two axes) changed since they were last colored
+        self.colors = None
+        self.dirty = None
+        # the histogram of the image, once the histogram was shown for it
+        self.histogram = None
+        super(RowImageItem, self).__init__(*args, **kwargs)
+
+    def setImage(self, image=None, **kwargs):
+        if image is not None:
+            self.histogram = None
+        super(RowImageItem, self).setImage(image, **kwargs)
+        if image is None:
+            return
+        self.colors = self.dirty = None
+        if self.buffer is None and self.image is not None and self.image.ndim == 2 and \
+                self.image.size >= TILED_PIXELS and self.axisOrder == 'col-major':
+            if self.pyramid is None or self.pyramid.image is not self.image:
+                self.pyramid = ImagePyramid(self.image)
+        else:
+            self.pyramid = None
+
+    def _tiled(self):
+        return self.pyramid is not None and self.pyramid.image is self.image and not self.autoDownsample
+
+    def _lut_and_levels(self):
+        lut = self.lut(self.image) if callable(self.lut) else self.lut
+        levels = self.levels
+        return lut, levels, (id(lut), None if levels is None else tuple(np.ravel(levels)))
+
+    def getHistogram(self, *args, **kwargs):
+        # the histogram widget asks for the same one every time the image or level mode changes
+        if args or kwargs:
+            return super(RowImageItem, self).getHistogram(*args, **kwargs)
+        if self.histogram is None:
+            self.histogram = super(RowImageItem, self).getHistogram()
+        return self.histogram
+
+    def update_region(self, xs, ys):
+        """Redraws image[xs, ys] after it was changed in place"""
+        self.histogram = None
+        if self._tiled():
+            self.pyramid.update(xs, ys)
+        elif self.dirty is None:
+            # colored in full on the next render, from then on region by region
+            self.dirty = []
+        else:
+            self.dirty.append((xs, ys))
+        self._renderRequired = True
+        self.update()
+
+    def render(self):
+        if self._tiled():
+            # nothing to render up front, paint colors the tiles it needs
+            self._renderRequired = False
+            self._unrenderable = False
+            return
+        if self.dirty is not None:
+            return self._render_regions()
+        buf = self.buffer
+        if buf is None or self.image is None or self.image.base is not buf._data or \
+                self.image.shape != (buf.width, len(buf)) or self.autoDownsample or buf.has_nans or self.axisOrder != 'col-major':
+            return super(RowImageItem, self).render()
+        lut, levels, key = self._lut_and_levels()
+        if key != self._color_key:
+            self._color_key = key
+            buf.recolor()
+        if buf.colored < buf.stop:
+            new = slice(buf.colored, buf.stop)
+            pg.functions.makeARGB(buf._data[new], lut=lut, levels=levels, output=buf._colors[new])
+            buf.colored = buf.stop
+        self.qimage = pg.functions.ndarray_to_qimage(buf.colors, QtGui.QImage.Format_ARGB32)
+        self._renderRequired = False
+        self._unrenderable = False
+
+    def _render_regions(self):
+        image = self.image
+        lut, levels, key = self._lut_and_levels()
+        if levels is None or image.ndim != 2 or self.autoDownsample or self.axisOrder != 'col-major':
+            self.dirty = None
+            return super(RowImageItem, self).render()
+        if self.colors is None or key != self._color_key or self.colors.shape[:2] != image.shape[::-1]:
+            self._color_key = key
+            self.colors = np.empty(image.shape[::-1] + (4,), np.ubyte)
+            self.dirty = [(slice(None), slice(None))]
+        for xs, ys in self.dirty:
+            pg.functions.makeARGB(image[xs, ys].T, lut=lut, levels=levels, output=self.colors[ys, xs])
+        self.dirty = []
+        self.qimage = pg.functions.ndarray_to_qimage(self.colors, QtGui.QImage.Format_ARGB32)
+        self._renderRequired = False
+        self._unrenderable = False
+
+    def paint(self, painter, *args):
+        if not self._tiled():
+            return super(RowImageItem, self).paint(painter, *args)
+        pyramid = self.pyramid
+        visible = self.boundingRect()
+        vb = self.getViewBox()
+        if vb is not None:
+            visible = visible.intersected(self.mapRectFromView(vb.viewRect()))
+        if visible.isEmpty():
+            return
+        # the level whose pixels are about as big as the screen's
+        dx, dy = self.pixelVectors()
+        pixel = min(np.hypot(dx.x(), dx.y()), np.hypot(dy.x(), dy.y())) if dx is not None else 1
+        k = min(max(int(np.floor(np.log2(pixel))), 0), pyramid.top) if pixel > 0 else 0
+        lut, levels, key = self._lut_and_levels()
+        nx, ny = pyramid.level(k).shape
+        scale = 2**k
+        size = pyramid.TILE*scale
+        if self.paintMode is not None:
+            painter.setCompositionMode(self.paintMode)
+        for i in range(max(int(visible.left() // size), 0), min(int(visible.right() // size) + 1, -(-nx // pyramid.TILE))):
+            for j in range(max(int(visible.top() // size), 0), min(int(visible.bottom() // size) + 1, -(-ny // pyramid.TILE))):
+                qimage = pyramid.tile(k, i, j, lut, levels, key)
+                painter.drawImage(QtCore.QRectF(i*size, j*size, qimage.width()*scale, qimage.height()*scale), qimage)
+
+
+class LevelsImageView(pg.ImageView):
+    """
+    ImageView that can be given the levels of the image it is to show, which it would
+    otherwise estimate again from the image every time it is set.
+    """
+    def __init__(self, *args, **kwargs):
+        # (image, its levels) as given to setImage
+        self.known_levels = None
+        super(LevelsImageView, self).__init__(*args, **kwargs)
+
+    def setImage(self, img, *args, known_levels=None, **kwargs):
+        self.known_levels = (img, known_levels) if known_levels is not None else None
+        super(LevelsImageView, self).setImage(img, *args, **kwargs)
+
+    def quickMinMax(self, data):
+        if self.known_levels is not None and data is self.known_levels[0] and self.axes['c'] is None:
+            return [self.known_levels[1]]
+        return super(LevelsImageView, self).quickMinMax(data)
+
+
 class CrosshairDock(CloseableDock):
     def __init__(self, **kwargs):
         self.plot_widget = CrosshairPlotWidget()
@@ -131,46 +735,175 @@ class CrosshairDock(CloseableDock):
         self.used_symbols = {}
         self.used_brush = {}
         self.curves = {}
+        self.buffers = {}
+        # curves whose buffer grew since they were last drawn, with their draw arguments
+        self.stale = {}
+        # long curves drawn as the min/max envelope of the visible range: (pyramid, xs, ys)
+        self.lod = {}
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self.view_changed)
 
     def plot(self, *args, **kwargs):
-        self.plot_widget.parametric = kwargs.pop('parametric', False)
+        self.buffers.pop(kwargs.get('name', ''), None)
+        self.stale.pop(kwargs.get('name', ''), None)
+        self._draw(*[np.abs(a) if np.iscomplexobj(a) else a for a in args], **kwargs)
+
+    def _draw(self, *args, **kwargs):
+        parametric = self.plot_widget.parametric = kwargs.pop('parametric', False)
         self.plot_widget.setLabel("bottom", text=kwargs.get('xname', ''), units=kwargs.get('xscale', ''))
         self.plot_widget.setLabel("left", text=kwargs.get('yname', ''), units=kwargs.get('yscale', ''))
         name = kwargs.get('name', '')
+        scatter = kwargs.pop('scatter', 'False') == 'True'
+        keep = kwargs.pop('keep', 0)
+        lod = kwargs.pop('lod', None)
+        if not (parametric or scatter):
+            args = self._level_of_detail(name, args, keep, lod)
+        else:
+            self.lod.pop(name, None)
 
         if name in self.curves: 
-            if kwargs.get('scatter', '')=='True':
+            if scatter:
                 kwargs['pen'] = None;
                 kwargs['symbol'] = self.used_symbols[name]
                 kwargs['symbolPen'] = self.used_pens[name]
                 kwargs['symbolBrush'] = self.used_brush[name]
                 kwargs['symbolSize'] = 7
                 self.curves[name].setData(*args, **kwargs)
-            elif kwargs.get('scatter', '')=='False':
+            else:
                 kwargs['pen'] = self.used_colors[name]
                 self.curves[name].setData(*args, **kwargs)
         else:
-            if kwargs.get('scatter', '')=='True':
+            if scatter:
+                if name not in self.used_symbols:
+                    self.used_symbols[name] = self.avail_symbols.pop()
+                    self.used_pens[name] = self.avail_sym_pens.pop()
+                    self.used_brush[name] = self.avail_sym_brush.pop()
                 kwargs['pen'] = None;
-                kwargs['symbol'] = self.used_symbols[name] = self.avail_symbols.pop()
-                kwargs['symbolPen'] = self.used_pens[name] = self.avail_sym_pens.pop()
-                kwargs['symbolBrush'] = self.used_brush[name] = self.avail_sym_brush.pop()
+                kwargs['symbol'] = self.used_symbols[name]
+                kwargs['symbolPen'] = self.used_pens[name]
+                kwargs['symbolBrush'] = self.used_brush[name]
                 kwargs['symbolSize'] = 7
                 self.curves[name] = self.plot_widget.plot(*args, **kwargs)
-            elif kwargs.get('scatter', '')=='False':
-                kwargs['pen'] = self.used_colors[name] = self.avail_colors.pop()
+            else:
+                if name not in self.used_colors:
+                    self.used_colors[name] = self.avail_colors.pop()
+                kwargs['pen'] = self.used_colors[name]
                 self.curves[name] = self.plot_widget.plot(*args, **kwargs)
 
+    def _level_of_detail(self, name, args, keep, pyramid=None):
+        """
+        The arguments to draw a curve with, its envelope if it is long, see MinMaxPyramid.
+        pyramid, if given, was already brought up to date with the curve.
+        """
+        ys = np.asarray(args[-1])
+        if len(ys) < LOD_POINTS or ys.ndim != 1:
+            self.lod.pop(name, None)
+            return args
+        xs = np.asarray(args[0]) if len(args) > 1 else np.arange(len(ys))
+        if pyramid is None:
+            pyramid = self.lod[name][0] if name in self.lod else MinMaxPyramid()
+            pyramid.update(xs, ys, keep)
+        if not pyramid.monotonic:
+            self.lod.pop(name, None)
+            return args
+        self.lod[name] = pyramid, xs, ys
+        return self._envelope(name)
+
+    def _envelope(self, name):
+        pyramid, xs, ys = self.lod[name]
+        vb = self.plot_widget.getViewBox()
+        i0, i1 = 0, len(xs)
+        if not vb.autoRangeEnabled()[0]:
+            x0, x1 = vb.viewRange()[0]
+            # one point beyond either edge, so the curve runs off the view
+            i0 = max(np.searchsorted(xs, x0) - 1, 0)
+            i1 = min(np.searchsorted(xs, x1, 'right') + 1, len(xs))
+        return pyramid.envelope(xs, ys, i0, i1, max(int(vb.width()), LOD_MIN_BINS))
+
+    def view_changed(self):
+        for name in self.lod:
+            if name in self.curves:
+                self.curves[name].setData(*self._envelope(name))
+
+    def _buffer(self, name, max_points):
+        buf = self.buffers.get(name)
+        if buf is None:
+            buf = self.buffers[name] = CurveBuffer(max_points)
+            xs, ys = self.get_data(name)
+            if ys is not None:
+                buf.extend(xs, ys)
+        else:
+            buf.set_max_points(max_points)
+        return buf
+
+    def update_y(self, ys, offset=0, **kwargs):
+        """
+        Writes ys into the curve from point offset on. A long curve is changed in place and
+        only the part of its envelope covering them is computed again.
+        """
+        name = kwargs.get('name', '')
+        ys = np.abs(ys) if np.iscomplexobj(ys) else np.asarray(ys)
+        # appended points go in first
+        self.render()
+        stop = offset + len(ys)
+        if name in self.lod:
+            pyramid, old_xs, old_ys = self.lod[name]
+            if stop <= len(old_ys) and np.result_type(old_ys.dtype, ys.dtype) == old_ys.dtype:
+                old_ys[offset:stop] = ys
+                pyramid.refresh(old_ys, offset, stop)
+                self.curves[name].setData(*self._envelope(name))
+                return
+        old_xs, old_ys = self.get_data(name)
+        old_xs = np.asarray(old_xs if old_xs is not None else [], dtype=float)
+        old_ys = np.asarray(old_ys if old_ys is not None else [])
+        new = np.full(max(stop, len(old_ys)), np.nan, np.result_type(old_ys.dtype, ys.dtype, float))
+        new[:len(old_ys)] = old_ys
+        new[offset:stop] = ys
+        # points beyond the end continue the curve's last step
+        step = old_xs[-1] - old_xs[-2] if len(old_xs) > 1 else 1.
+        last = old_xs[-1] if len(old_xs) else -1.
+        xs = np.concatenate([old_xs, last + step*np.arange(1, len(new) - len(old_xs) + 1)])
+        self.plot(xs[:len(new)], new, name=name)
+
+    def append_y(self, y, start_step=None, max_points=None, **kwargs):
+        buf = self._buffer(kwargs.get('name', ''), max_points)
+        if start_step is not None:
+            x0, dx = start_step
+            buf.append(x0 + buf.count*dx, y)
+        else:
+            buf.append(buf.count, y)
+        self.stale[kwargs.get('name', '')] = kwargs
+
+    def append_xy(self, x, y, max_points=None, **kwargs):
+        buf = self._buffer(kwargs.get('name', ''), max_points)
+        buf.append(x, y)
+        self.stale[kwargs.get('name', '')] = dict(kwargs, parametric=True)
+
+    def render(self):
+        for name, kwargs in self.stale.items():
+            buf = self.buffers.get(name)
+            if buf is not None:
+                # a growing curve keeps the part of its envelope that was already built
+                keep = len(self.lod[name][2]) if name in self.lod and buf.max_points is None else 0
+                self._draw(buf.xs, buf.ys, keep=keep, **kwargs)
+        self.stale.clear()
+
     def clear(self):
         self.plot_widget.clear()
+        self.curves.clear()
+        self.buffers.clear()
+        self.stale.clear()
+        self.lod.clear()
 
     def get_data(self, label):
+        if label in self.lod:
+            return self.lod[label][1], self.lod[label][2]
         if label in self.curves:
             return self.curves[label].getData()
         else:
             return [], []
 
     def redraw(self):
+        self.render()
         xs_ys = []
         for name in self.curves:
             xs_ys.append((name,) + self.get_data(name))
@@ -184,15 +917,35 @@ class CrosshairDock(CloseableDock):
 class CrossSectionDock(CloseableDock):
     def __init__(self, trace_size=90, **kwargs):
         self.plot_item = view = pg.PlotItem(labels=kwargs.pop('labels', None))
-        self.img_view = kwargs['widget'] = pg.ImageView(view=view)
+        self.img_view = kwargs['widget'] = LevelsImageView(view=view, imageItem=RowImageItem(np.zeros((1, 1))))
         view.setAspectLocked(lock=False)
         self.ui = self.img_view.ui
         self.imageItem = self.img_view.imageItem
+        self.row_buffer = None
+        # (buffer, _show_rows arguments) of rows appended since the last frame
+        self.stale_rows = None
         super(CrossSectionDock, self).__init__(**kwargs)
         self.closeClicked.connect(self.hide_cross_section)
         self.cross_section_enabled = False
         self.search_mode = False
         self.signals_connected = False
+        # position and pixel size of the image shown
+        self._x0, self._y0, self._xscale, self._yscale = 0, 0, 1, 1
+        # (geometry, x and y coordinates of the pixels) of the image shown
+        self.axes = None
+        # (image, x and y index, geometry) the traces were last drawn for
+        self.cross_section_shown = None
+        # the levels of the image shown as autoscaling picks them, and the levels autoscaling
+        # shows, which only follow those slowly in slow autoscaling, see set_autoscale
+        self.data_levels = None
+        self.shown_levels = None
+        self.percentiles = None
+        self.relevel_every = None
+        self.level_smoothing = None
+        self.slow_levels_requested = None, None
+        self.frames_unleveled = 0
+        # pyqtgraph's histogram follows the image from the start
+        self.histogram_shown = True
         self.set_histogram(False)
         histogram_action = QtWidgets.QAction('Histogram', self)
         histogram_action.setCheckable(True)
@@ -203,9 +956,14 @@ class CrossSectionDock(CloseableDock):
         self.autolevels_action.setCheckable(True)
         self.autolevels_action.setChecked(True)
         self.autolevels_action.triggered.connect(self.redraw)
-        self.ui.histogram.item.sigLevelChangeFinished.connect(lambda: self.autolevels_action.setChecked(False))
+        self.setting_levels = False
+        self.ui.histogram.item.sigLevelChangeFinished.connect(self.levels_changed)
         self.img_view.scene.contextMenu.append(self.autolevels_action)
 
+        self.slow_levels_action = QtWidgets.QAction('Slow Autoscale', self)
+        self.slow_levels_action.setCheckable(True)
+        self.img_view.scene.contextMenu.append(self.slow_levels_action)
+
         self.clear_action = QtWidgets.QAction('Clear Contents', self)
         self.clear_action.triggered.connect(self.clear)
         self.img_view.scene.contextMenu.append(self.clear_action)
@@ -245,7 +1003,24 @@ class CrossSectionDock(CloseableDock):
         self.v_cross_section_widget.plotItem.setLabel(axis='bottom', text=kwargs.get('yname', ''), units=kwargs.get('yscale', ''))
         self.h_cross_section_widget.plotItem.setLabel(axis='left', text=kwargs.get('zname', ''), units=kwargs.get('zscale', ''))
 
-    def setImage(self, *args, **kwargs):
+    def setImage(self, img, *args, **kwargs):
+        """
+        Shows img in its own dtype, complex images are shown as their magnitude. auto_levels,
+        if given, are the levels autoscaling would pick, worked out ahead.
+        """
+        self.row_buffer = self.imageItem.buffer = None
+        self.stale_rows = None
+        if np.iscomplexobj(img):
+            img = np.abs(img)
+        levels = kwargs.pop('auto_levels', None)
+        if levels is None and np.ndim(img) == 2:
+            levels = image_levels(img, self.percentiles)
+        self.data_levels = levels
+        if levels is not None and self.autolevels_action.isChecked():
+            kwargs.update(autoLevels=False, levels=self._follow_levels(levels))
+        self._set_image(img, *args, known_levels=levels, **kwargs)
+
+    def _set_image(self, *args, **kwargs):
         item = self.plot_item.getViewBox()
         item.invertY(False)        
         if 'pos' in kwargs:
@@ -259,16 +1034,161 @@ class CrossSectionDock(CloseableDock):
 
         autorange = self.img_view.getView().vb.autoRangeEnabled()[0]
         kwargs['autoRange'] = autorange
+        kwargs.setdefault('autoLevels', self.autolevels_action.isChecked())
+        self.setting_levels = True
         self.img_view.setImage(*args, **kwargs)
+        self.setting_levels = False
         self.img_view.getView().vb.enableAutoRange(enable=autorange)
 
         self.update_cross_section()
 
+    def update_region(self, patch, offset=(0, 0)):
+        """
+        Writes patch into the image with its first element at offset (row, column, as for the
+        arrays of setImage). The image shown is changed in place and only that part of it is
+        colored, and taken into account for the levels, again. If the patch doesn't fit the image
+        grows, filled with NaN.
+        """
+        patch = np.asarray(patch)
+        if np.iscomplexobj(patch):
+            patch = np.abs(patch)
+        # rows appended since the last frame go in first
+        self.render()
+        i, j = offset
+        rows, cols = i + patch.shape[0], j + patch.shape[1]
+        image = self.img_view.image
+        if self.get_data() is None or self.row_buffer is not None or image.ndim != 2 or \
+                self.img_view.imageDisp is not image or rows > image.shape[0] or cols > image.shape[1] or \
+                np.result_type(image.dtype, patch.dtype) != image.dtype:
+            old = self.get_data()
+            old = np.transpose(old) if old is not None and old.ndim == 2 else np.empty((0, 0), patch.dtype)
+            dtype = np.result_type(old.dtype, patch.dtype)
+            image = np.full((max(rows, old.shape[0]), max(cols, old.shape[1])), np.nan if dtype.kind in 'fc' else 0, dtype)
+            image[:old.shape[0], :old.shape[1]] = old
+            image[i:rows, j:cols] = patch
+            self.setImage(image, pos=(self._x0, self._y0), scale=(self._xscale, self._yscale), axes={'y':0, 'x':1})
+            return
+        image[i:rows, j:cols] = patch
+        if patch.size:
+            lo, hi = np.fmin.reduce(patch, axis=None), np.fmax.reduce(patch, axis=None)
+            if self.data_levels is not None:
+                lo, hi = np.fmin(lo, self.data_levels[0]), np.fmax(hi, self.data_levels[1])
+            if np.isfinite(lo) and np.isfinite(hi):
+                self.data_levels = float(lo), float(hi)
+        levels = self.imageItem.levels
+        if self.autolevels_action.isChecked() and levels is not None and self.data_levels is not None:
+            new_levels = self._follow_levels(self.data_levels)
+            if new_levels != tuple(np.ravel(levels)[:2]):
+                self.setting_levels = True
+                self.img_view.setLevels(*new_levels)
+                self.setting_levels = False
+        # the image item shows the image transposed, x along the columns
+        self.imageItem.update_region(slice(j, cols), slice(i, rows))
+        if self.cross_section_enabled and (j <= self.x_cross_index < cols or i <= self.y_cross_index < rows):
+            self.cross_section_shown = None
+            self.update_cross_section()
+
+    def append_row(self, row, max_rows=None, **kwargs):
+        """
+        Add a row to the top of the image, keeping the rows in an ImageBuffer so that
+        only the new row has to be stored, colored and taken into account for the levels.
+        """
+        row = np.asarray(row)
+        if np.iscomplexobj(row):
+            row = np.abs(row)
+        buf = self.stale_rows[0] if self.stale_rows is not None else self.row_buffer
+        if buf is None or buf.width != len(row) or buf.max_rows != max_rows or \
+                np.result_type(buf.dtype, row.dtype) != buf.dtype:
+            if buf is not None and buf.width == len(row):
+                rows = buf.rows
+            else:
+                image = self.get_data()
+                rows = np.transpose(image) if image is not None and image.shape[0] == len(row) else []
+            buf = ImageBuffer(len(row), np.result_type(row.dtype, *[r.dtype for r in rows[:1]]), max_rows)
+            for r in rows:
+                buf.append(r)
+        buf.append(row)
+        self.stale_rows = buf, kwargs
+
+    def render(self):
+        if self.stale_rows is not None:
+            buf, kwargs = self.stale_rows
+            self.stale_rows = None
+            self._show_rows(buf, **kwargs)
+
+    def _show_rows(self, buf, **kwargs):
+        self.data_levels = buf.levels()
+        levels = self._follow_levels(self.data_levels) if self.autolevels_action.isChecked() else None
+        geometry = kwargs.get('pos', (0, 0)), kwargs.get('scale', (1, 1))
+        rows = buf.rows
+        if buf is not self.row_buffer or geometry != ((self._x0, self._y0), (self._xscale, self._yscale)):
+            self.row_buffer = self.imageItem.buffer = buf
+            if levels is not None:
+                kwargs['levels'] = levels
+            self._set_image(rows, axes={'y':0, 'x':1}, autoLevels=False, known_levels=self.data_levels, **kwargs)
+            return
+        self.img_view.image = rows
+        self.img_view.imageDisp = None
+        self.img_view.known_levels = rows, self.data_levels
+        if levels is not None:
+            self.setting_levels = True
+            self.img_view.setLevels(*levels)
+            self.setting_levels = False
+        self.imageItem.setImage(rows.T, autoLevels=False)
+        if self.cross_section_enabled:
+            self.update_cross_section()
+
     def setTitle(self, text):
         self.plot_item.setTitle(text)
 
+    def levels_changed(self):
+        if not self.setting_levels:
+            self.autolevels_action.setChecked(False)
+            self.shown_levels = None
+
+    def set_autoscale(self, percentiles=None, every=None, smoothing=None):
+        """
+        How autoscaling picks the levels of images set from now on: from the (low, high) percentiles
+        of their pixels if given, rather than min and max. If every or smoothing are given autoscaling
+        is slow, it only levels every so many images and then moves the levels smoothing (default 1,
+        or SLOW_LEVELS without every) of the way to those of the image. Appended rows and updated
+        regions only ever widen the levels, by their min and max. The context menu can turn slow
+        autoscaling on and off, it is only set again when every or smoothing change.
+        """
+        self.percentiles = percentiles
+        if (every, smoothing) != self.slow_levels_requested:
+            self.slow_levels_requested = every, smoothing
+            self.relevel_every, self.level_smoothing = every, smoothing
+            self.slow_levels_action.setChecked(every is not None or smoothing is not None)
+
+    def _follow_levels(self, levels):
+        """The levels autoscaling shows once the levels of the image shown are levels"""
+        if self.shown_levels is None or not self.slow_levels_action.isChecked():
+            self.shown_levels = levels
+            self.frames_unleveled = 0
+            return levels
+        self.frames_unleveled += 1
+        if self.relevel_every is not None and self.frames_unleveled < self.relevel_every:
+            return self.shown_levels
+        self.frames_unleveled = 0
+        if self.level_smoothing is not None:
+            smoothing = self.level_smoothing
+        else:
+            smoothing = 1 if self.relevel_every is not None else SLOW_LEVELS
+        (lo, hi), (new_lo, new_hi) = self.shown_levels, levels
+        self.shown_levels = lo + smoothing*(new_lo - lo), hi + smoothing*(new_hi - hi)
+        return self.shown_levels
+
     def redraw(self):
-        self.setImage(self.img_view.imageItem.image)
+        self.render()
+        if self.row_buffer is not None:
+            self._show_rows(self.row_buffer, pos=(self._x0, self._y0), scale=(self._xscale, self._yscale))
+        elif self.data_levels is not None and self.autolevels_action.isChecked():
+            # straight to the levels of the image, slow autoscaling or not
+            self.shown_levels = self.data_levels
+            self._set_image(self.img_view.imageItem.image, autoLevels=False, levels=self.data_levels)
+        else:
+            self._set_image(self.img_view.imageItem.image)
 
     def get_data(self):
         img = self.img_view.imageItem.image
@@ -287,6 +1207,14 @@ class CrossSectionDock(CloseableDock):
             self.add_cross_section()
 
     def set_histogram(self, visible):
+        # the histogram is only worked out while it is shown
+        item = self.ui.histogram.item
+        if visible and not self.histogram_shown:
+            self.imageItem.sigImageChanged.connect(item.imageChanged)
+            item.imageChanged()
+        elif not visible and self.histogram_shown:
+            self.imageItem.sigImageChanged.disconnect(item.imageChanged)
+        self.histogram_shown = visible
         self.ui.histogram.setVisible(visible)
         self.ui.roiBtn.setVisible(visible)
         self.ui.normGroup.setVisible(visible)
@@ -304,6 +1232,7 @@ class CrossSectionDock(CloseableDock):
         self.plot_item.addItem(self.v_line, ignoreBounds=False)
         self.x_cross_index = 0
         self.y_cross_index = 0
+        self.cross_section_shown = None
         self.cross_section_enabled = True
         self.text_item = pg.LabelItem(justify="right")
         #self.img_view.ui.gridLayout.addWidget(self.text_item, 2, 1, 1, 2)
@@ -333,10 +1262,17 @@ class CrossSectionDock(CloseableDock):
         if self.imageItem.scene() is None:
             raise RuntimeError('Signal can only be connected after it has been embedded in a scene.')
         self.imageItem.scene().sigMouseClicked.connect(self.toggle_search)
-        self.imageItem.scene().sigMouseMoved.connect(self.handle_mouse_move)
+        # at most one cross section update per screen refresh
+        screen = QtGui.QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen is not None else 60
+        self.mouse_proxy = pg.SignalProxy(self.imageItem.scene().sigMouseMoved, rateLimit=rate or 60,
+                                          slot=self.mouse_moved)
         self.img_view.timeLine.sigPositionChanged.connect(self.update_cross_section)
         self.signals_connected = True
 
+    def mouse_moved(self, args):
+        self.handle_mouse_move(args[0])
+
     def toggle_search(self, mouse_event):
         if mouse_event.double():
             self.toggle_cross_section()
@@ -363,11 +1299,27 @@ class CrossSectionDock(CloseableDock):
             self.update_cross_section()
             self.text_item.setText("x=%.2f, y=%.2f, z=%.2f" % (view_x, view_y, z_val))
 
-    def update_cross_section(self):
+    def axis_data(self):
+        """The x and y coordinates of the image's pixels, computed again only when its geometry changes"""
         nx, ny = self.imageItem.image.shape
-        x0, y0, xscale, yscale = self._x0, self._y0, self._xscale, self._yscale
-        xdata = np.linspace(x0, x0+(xscale*(nx-1)), nx)
-        ydata = np.linspace(y0, y0+(yscale*(ny-1)), ny)
+        geometry = nx, ny, self._x0, self._y0, self._xscale, self._yscale
+        if self.axes is None or self.axes[0] != geometry:
+            x0, y0, xscale, yscale = self._x0, self._y0, self._xscale, self._yscale
+            xdata = np.linspace(x0, x0+(xscale*(nx-1)), nx)
+            ydata = np.linspace(y0, y0+(yscale*(ny-1)), ny)
+            self.axes = geometry, xdata, ydata
+        return self.axes[1:]
+
+    def update_cross_section(self):
+        if not self.cross_section_enabled:
+            return
+        shown = (self.imageItem.image, self.x_cross_index, self.y_cross_index,
+                 self._x0, self._y0, self._xscale, self._yscale)
+        last = self.cross_section_shown
+        if last is not None and last[0] is shown[0] and last[1:] == shown[1:]:
+            return
+        self.cross_section_shown = shown
+        xdata, ydata = self.axis_data()
         zval = self.imageItem.image[self.x_cross_index, self.y_cross_index]
         self.h_cross_section_widget_data.setData(xdata, self.imageItem.image[:, self.y_cross_index])
         self.h_cross_section_widget.v_line.setPos(xdata[self.x_cross_index])
@@ -1,24 +1,92 @@
+import argparse
 import atexit
+import collections
+import concurrent.futures
 import os
-import json
 import logging
 import signal
 import socket
-from . import widgets
+import uuid
+from . import widgets, protocol, history, recording
 import numpy as np
-from PyQt5.QtCore import QSharedMemory, QSize
+from PyQt5.QtCore import QSharedMemory, QSize, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QMainWindow, QApplication, QDockWidget, QListView, QAction
 from PyQt5.QtGui import QStandardItem,QStandardItemModel, QIcon
 from PyQt5.QtNetwork import QLocalServer
 from PyQt5.Qt import Qt as QtConst
 from pyqtgraph.dockarea import DockArea
 import time
+from multiprocessing import resource_tracker, shared_memory
 
 logging.root.setLevel(logging.WARNING)
 
+# Bytes taken off a socket per turn of a client, splitting them into frames is
+# part of the time budget.
+READ_SIZE = 2**18
+
+# Share of a scheduler round of a client of weight 1: bytes of messages and of
+# the arrays in their slots, and number of messages. Every STATS_INTERVAL
+# seconds the window works out each client's throughput and longest wait.
+QUANTUM = 2**20
+MESSAGES = 256
+STATS_INTERVAL = 1.
+
+# Operations that replace what a plot (or one of its curves) shows. Only the
+# latest one per plot and curve is kept until the next frame.
+COALESCED = ('plot_y', 'plot_xy', 'plot_z', 'label')
+
+# Operations whose streamed arrays are shown as they arrive, the part of the
+# first axis received so far, at most once every PROGRESS_INTERVAL seconds.
+PROGRESSIVE = ('plot_y', 'plot_z')
+PROGRESS_INTERVAL = 0.2
+
+# Operations kept in the History, whose plots can be scrubbed back through them.
+HISTORY = ('plot_y', 'plot_z')
+
+
+def prepare(ops, ahead=True):
+    """
+    Runs on the window's ingest pool: copies the arrays of ops, (meta, array in a slot or
+    None) pairs, out of shared memory and, if ahead, works out ahead of the GUI thread what
+    the plots would otherwise work out when they are drawn. Returns the ops with their own arrays.
+    """
+    prepared = []
+    for meta, arr in ops:
+        if arr is not None:
+            # the plots show the magnitude of complex arrays
+            arr = np.abs(arr) if np.iscomplexobj(arr) else np.array(arr)
+            if ahead and meta['operation'] == 'plot_y':
+                if meta.get('start_step') is not None:
+                    x0, dx = meta['start_step']
+                    meta['xs'] = np.linspace(x0, x0 + (len(arr) - 1)*dx, len(arr))
+                if arr.ndim == 1 and len(arr) >= widgets.LOD_POINTS:
+                    meta['lod'] = widgets.MinMaxPyramid()
+                    meta['lod'].update(meta.get('xs', np.arange(len(arr))), arr)
+            elif ahead and meta['operation'] == 'plot_z' and arr.ndim == 2:
+                meta['levels'] = widgets.image_levels(arr, meta.get('percentiles'))
+        prepared.append((meta, arr))
+    return prepared
+
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # a client's message got through the ingest pool, see submit
+    prepared = pyqtSignal(object)
+
+    def __init__(self, fps=30, budget=20, workers=None, history_memory=2**28, history_spill=0, spill_dir=None,
+                 record=None):
+        """
+        Operations are taken off the sockets as they arrive, but the plots are only
+        drawn fps times per second. Clients with messages waiting are served by a
+        Scheduler, which returns to the event loop after budget milliseconds and
+        continues right after, so a flood of messages can't freeze the window and a
+        busy client can't keep the others waiting. Arrays are copied out of shared
+        memory and prepared for plotting by a pool of worker threads, the GUI thread
+        only hands the results to the plots. By default there are two workers if
+        there are cores to spare, with workers=0 the GUI thread prepares arrays itself.
+        Earlier frames of plot_y and plot_z are kept in a History of history_memory bytes
+        in memory and history_spill bytes in a file in spill_dir, none if both are 0.
+        If record is given every message read is recorded to that session file, see replay.
+        """
         super(MainWindow, self).__init__()
         self.setStyleSheet("background-color: rgb(24, 25, 26); color: rgb(255, 170, 0); ") 
         self.setWindowTitle("Liveplot - Plotting dashboard!")
@@ -28,59 +96,440 @@ class MainWindow(QMainWindow):
         self.namelist = NameList(self)
         self.addDockWidget(QtConst.LeftDockWidgetArea, self.namelist)
         self.server = QLocalServer()
-        self.server.removeServer('LivePlot')
-        self.server.listen('LivePlot')
+        self.server.removeServer(protocol.SERVER)
+        self.server.listen(protocol.SERVER)
         self.server.newConnection.connect(self.accept)
         self.bytes = bytearray()
         self.target_size = 0
         self.meta = None
         self.insert_dock_right = True
-        self.conns = []
-        self.shared_mems = []
+        self.pool = SegmentPool()
+        if workers is None:
+            workers = max(min(2, (os.cpu_count() or 1) - 1), 0)
+        self.workers = concurrent.futures.ThreadPoolExecutor(workers, 'LivePlot ingest') if workers else None
+        self.prepared.connect(self.finish)
+        atexit.register(self.free_memory)
+        self.clients = []
+        self.scheduler = Scheduler()
+        self.client_stats = []
+        self.stats_time = time.perf_counter()
+        self.drain_timer = QTimer()
+        self.drain_timer.setInterval(0)
+        self.drain_timer.timeout.connect(self.drain)
+        self.pending = {}
+        self.superseded = 0
+        if history_memory or history_spill:
+            self.history = history.History(history_memory, history_spill, spill_dir)
+        else:
+            self.history = None
+        # name -> frame of the plots scrubbed back in their history
+        self.scrubbed = {}
+        self.recorder = recording.Recorder(record) if record is not None else None
+        # the session played back, see replay
+        self.recording = None
+        self.replay_timer = QTimer()
+        self.replay_timer.setSingleShot(True)
+        self.replay_timer.timeout.connect(self.play)
+        self.budget = budget/1000.
+        self.backlog = 0
+        self.status = ''
+        self.frame_timer = QTimer()
+        self.frame_timer.timeout.connect(self.render_frame)
+        self.set_fps(fps)
         signal.signal(signal.SIGINT, self.close)
 
+    def set_fps(self, fps):
+        if not fps > 0:
+            raise ValueError('Frame rate must be positive, got %s' % fps)
+        self.frame_timer.start(int(round(1000./fps)))
+
 
     def close(self, sig=None, frame=None):
         print('closing')
-        for conn in self.conns:
-            conn.close()
-        for shm in self.shared_mems:
-            shm.detach()
+        for client in self.clients:
+            client.conn.close()
+        self.free_memory()
         QApplication.instance().exit()
 
+    def free_memory(self):
+        """Lets go of all shared memory, nothing is read from a client after this"""
+        if self.workers is not None:
+            self.workers.shutdown()
+        for client in self.clients:
+            client.detach()
+        self.pool.clear()
+        if self.history is not None:
+            self.history.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
 
     def accept(self):
         logging.debug('connection accepted')
         conn = self.server.nextPendingConnection()
-        conn.waitForReadyRead()
-        key = str(conn.read(36).decode())
-        memory = QSharedMemory()
-        memory.setKey(key)
-        memory.attach()
+        frames = protocol.FrameReader()
+        decoder = protocol.Decoder()
+        hello = None
+        while hello is None and conn.waitForReadyRead():
+            frames.feed(conn.readAll())
+            hello = next(frames, None)
+        if hello is None:
+            conn.close()
+            return
+        hello = decoder.decode(hello)
+        key = hello.get('key')
+        if key is None:
+            try:
+                key, memory = self.pool.take(hello['size'], hello.get('posix', False))
+            except EnvironmentError as e:
+                logging.warning('could not lend memory: %s' % e)
+                conn.close()
+                return
+            reply = protocol.segment_reply(key, memory.size())
+        elif key.startswith(protocol.POSIX_PREFIX):
+            try:
+                memory = PosixMemory(key[len(protocol.POSIX_PREFIX):])
+            except OSError:
+                logging.warning('could not attach to memory %s' % key)
+                conn.close()
+                return
+            reply = protocol.ACK
+        else:
+            # owned by the connection so it outlives every signal the connection emits
+            memory = QSharedMemory(conn)
+            memory.setKey(key)
+            memory.attach()
+            reply = protocol.ACK
         logging.debug('attached to memory %s with size %s'%(key, memory.size()))
-        atexit.register(memory.detach)
-        self.conns.append(conn)
-        self.shared_mems.append(memory)
-        conn.readyRead.connect(lambda: self.read_from(conn, memory))
-        conn.disconnected.connect(memory.detach)
-        conn.write(b'ok')
+        client = Client(conn, memory, frames, decoder, hello['slots'], key if reply != protocol.ACK else None)
+        client.name = '%s #%d' % (hello.get('name', 'client'), len(self.clients) + 1)
+        client.priority = hello.get('priority', 0)
+        client.weight = max(hello.get('weight', 1), 0.01)
+        self.clients.append(client)
+        conn.readyRead.connect(lambda: self.wake(client))
+        conn.disconnected.connect(lambda: self.drop(client))
+        conn.write(reply)
+        if frames.bytes:
+            self.wake(client)
+
+    def wake(self, client):
+        """Has the client's messages read on the scheduler's next round"""
+        self.scheduler.wake(client)
+        self.drain_timer.start()
+
+    def drop(self, client):
+        """Handles what a disconnected client sent last, then lets go of its memory"""
+        client.dropped = True
+        # unless the window is shutting down and has let go of it already
+        if client.region is not None:
+            self.wake(client)
 
     # noinspection PyNoneFunctionAssignment
-    def read_from(self, conn, memory):
+    def read_from(self, client, deadline):
+        """
+        Handles the client's messages until its share of the round is used up or the deadline
+        passes, returns whether it has more waiting
+        """
         logging.debug('reading data')
-        self.meta = json.loads(conn.read(300).decode())
-        if self.meta['arrsize'] != 0:
-            memory.lock()
-            ba = memory.data()[0:self.meta['arrsize']]
-            arr = np.frombuffer(memoryview(ba))
-            memory.unlock()
-            conn.write(b'ok')
-            arr = arr.reshape(self.meta['shape']).copy()
+        # acking can notice the disconnect and get here again, the outer call finishes up
+        if client.reading or client.region is None:
+            return False
+        client.reading = True
+        client.start_turn()
+        try:
+            # otherwise it is still paying for what it overdrew
+            if not client.turn_over():
+                if client.conn.bytesAvailable():
+                    client.frames.feed(client.conn.read(READ_SIZE))
+                for frame in client.frames:
+                    client.spend(self.read_frame(client, frame))
+                    if client.turn_over() or time.perf_counter() > deadline:
+                        break
+        finally:
+            client.reading = False
+        return client.frames.ready() or client.conn.bytesAvailable() > 0
+
+    def release(self, client):
+        """Forgets a disconnected client, its memory goes back to the pool if it was lent"""
+        # what is still being copied out of its memory comes first
+        concurrent.futures.wait([future for future, _ in client.jobs])
+        self.finish(client)
+        client.detach()
+        self.clients.remove(client)
+        if client.lent is not None:
+            self.pool.put(client.lent)
+        client.conn.deleteLater()
+
+    def drain(self):
+        """
+        Serves a round of the scheduler, then returns to the event loop to learn of clients
+        that got messages in the meantime. Only rounds in which every client was still paying
+        for what it overdrew follow each other right away.
+        """
+        deadline = time.perf_counter() + self.budget
+        read = 0
+        while self.scheduler.ready and not read and time.perf_counter() < deadline:
+            for client in self.scheduler.round():
+                if time.perf_counter() > deadline:
+                    break
+                messages = client.messages_read
+                more = self.read_from(client, deadline)
+                read += client.messages_read - messages
+                self.scheduler.served(client, more)
+                if not more and client.dropped and client in self.clients:
+                    self.release(client)
+        if not self.scheduler.ready:
+            self.drain_timer.stop()
+
+    def read_frame(self, client, frame):
+        """Handles a message, returns its size including the array in its slot"""
+        meta = client.decoder.decode(frame)
+        if self.recorder is not None and (meta is None or meta['operation'] != 'resize'):
+            self.recorder.record(client, frame, meta)
+        if meta is None:
+            return len(frame)
+        # of a streamed array only a piece is in the slot
+        size = len(frame) + min(meta['arrsize'], client.slot_size)
+        if meta['operation'] == 'batch':
+            self.do_batch(client, meta)
+        elif meta['operation'] == 'chunk':
+            client.check_slot(meta)
+            self.copy_piece(client, meta, meta['arrsize'])
+        elif meta['operation'] == 'resize':
+            self.resize(client, meta)
+        elif 'slot' in meta:
+            # every message with an array has a slot to ack, even if the array is empty
+            client.check_slot(meta)
+            if meta['chunked']:
+                client.stream = Stream(meta)
+                self.copy_piece(client, meta, client.slot_size - protocol.SLOT_HEADER)
+            else:
+                self.submit(client, lambda ops: self.acked(client, ops), prepare,
+                            [(meta, client.array(meta))], self.workers is not None)
         else:
-            arr = None
+            self.submit(client, lambda _: self.ingest(meta))
+        return size
+
+    def replay(self, path, speed=1., start=0, seconds=None):
+        """
+        Plays back a recorded session, speed times as fast as it was recorded (inf for as fast
+        as possible), from message start or from so many seconds into it on. Its messages go
+        through read_frame as if its clients were connected, their arrays straight from the file.
+        """
+        if not speed > 0:
+            raise ValueError('Replay speed must be positive, got %s' % speed)
+        self.recording = recording.Recording(path)
+        self.replay_speed = speed
+        self.seek(start if seconds is None else self.recording.index_at(seconds))
+
+    def seek(self, index):
+        """Goes on playing the session from message index"""
+        self.replay_index, self.replay_clients = self.recording.start_at(index)
+        recorded = self.recording.times[self.replay_index] if self.replay_index < len(self.recording) else 0
+        # when the message recorded at 0 s would be played
+        self.replay_clock = time.perf_counter() - recorded/self.replay_speed
+        self.replay_timer.start(0)
+
+    def play(self):
+        """Plays the messages of the session that are due, for no longer than the budget"""
+        deadline = time.perf_counter() + self.budget
+        while self.replay_index < len(self.recording):
+            due = self.replay_clock + self.recording.times[self.replay_index]/self.replay_speed
+            now = time.perf_counter()
+            if due > now or now > deadline:
+                self.replay_timer.start(max(int((due - now)*1000), 0))
+                return
+            _, number, slot_size, frame, payload = self.recording[self.replay_index]
+            client = self.replay_clients[number]
+            client.play(slot_size, payload)
+            self.replay_index += 1
+            self.read_frame(client, frame)
+
+    def submit(self, client, then, fn=None, *args):
+        """
+        Runs fn(*args) on the ingest pool, then then(result) on the GUI thread. Whatever is
+        submitted for a client is finished in the order it was submitted. Without fn, or
+        without a pool, then is called as soon as everything before it was.
+        """
+        if fn is not None and self.workers is not None:
+            future = self.workers.submit(fn, *args)
+            client.jobs.append((future, then))
+            # called right away if fn is done already
+            future.add_done_callback(lambda _: self.prepared.emit(client))
+            return
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args) if fn is not None else None)
+        except Exception as e:
+            future.set_exception(e)
+        client.jobs.append((future, then))
+        self.finish(client)
+
+    def finish(self, client):
+        """
+        Finishes what was submitted for the client, up to the first job that is still running.
+        A job that fails is logged and then gets None, the ones after it go on: they may have
+        slots to ack the client is waiting for.
+        """
+        while client.jobs and client.jobs[0][0].done():
+            future, then = client.jobs.popleft()
+            try:
+                result = future.result()
+            except Exception:
+                logging.exception('Failed to prepare an operation')
+                result = None
+            try:
+                then(result)
+            except Exception:
+                logging.exception('Failed to apply an operation')
+
+    def acked(self, client, ops):
+        """
+        Frees the slot of prepared ops, which have their own arrays by now, and takes them on.
+        ops is None if preparing them failed, the slot is freed all the same.
+        """
+        client.ack()
+        for meta, arr in ops or ():
+            self.ingest(meta, arr)
+
+    def copy_piece(self, client, meta, n):
+        """Has a worker copy the part of the client's streamed array in the message's slot"""
+        stream = client.stream
+        dst, src = stream.piece(n), client.payload(meta, n)
+        self.submit(client, lambda _: self.landed(client, stream, len(dst)), np.copyto, dst, src)
+
+    def landed(self, client, stream, n):
+        """
+        Applies a streamed operation once all of its array has been copied, or shows how far
+        it got
+        """
+        client.ack()
+        stream.received += n
+        meta = stream.meta
+        if stream.received == len(stream.data):
+            self.ingest(meta, stream.array())
+        elif meta['operation'] in PROGRESSIVE and time.perf_counter() > stream.progress_shown + PROGRESS_INTERVAL:
+            partial = stream.partial()
+            if len(partial):
+                stream.progress_shown = time.perf_counter()
+                self.ingest(meta, partial, partial=True)
+
+    def resize(self, client, meta):
+        """Trades the segment lent to a client for one of the size it asks for"""
+        if client.lent is None:
+            logging.warning('client with its own memory asked for a new segment')
+            return
+        posix = meta.get('posix', False)
+        self.pool.put(client.lent)
+        try:
+            key, memory = self.pool.take(meta['size'], posix)
+        except EnvironmentError as e:
+            # keep the old one, the client makes do with it
+            logging.warning('could not lend memory: %s' % e)
+            key, memory = self.pool.take(client.memory.size(), posix)
+        client.lend(key, memory, meta['slots'])
+        client.conn.write(protocol.segment_reply(key, memory.size()))
+
+    def ingest(self, meta, arr=None, partial=False):
+        """
+        Takes an operation off a socket. Operations in COALESCED wait for the next frame and
+        are dropped unseen if a newer one for the same plot and curve comes first. The others
+        are applied right away, after what is pending for their plot, but the widgets only
+        draw them on the next frame. Operations in HISTORY go in the history first, a plot
+        scrubbed back in it only takes them once it is live again, anything else makes it live.
+        arr was copied out of shared memory by then and can be kept, unless partial, the part
+        of a streamed array received so far. It is None for an empty array, which has no
+        frame in the history.
+        """
+        name = meta['name']
+        if meta['operation'] in HISTORY and self.history is not None and arr is not None and not partial:
+            self.history.record(meta, arr)
+        if name in self.scrubbed:
+            if meta['operation'] in HISTORY:
+                return
+            if meta['operation'] != 'label':
+                self.show_history(name, self.history.span(name)[1])
+        if meta['operation'] in COALESCED:
+            key = name, meta['label'], meta['operation'] == 'label'
+            if key in self.pending:
+                self.superseded += 1
+            self.pending[key] = meta, arr
+            return
+        self.apply_pending(name)
+        self.meta = meta
         self.do_operation(arr)
-        if conn.bytesAvailable():
-            self.read_from(conn, memory)
+
+    def apply_pending(self, name='*'):
+        if name == '*':
+            keys = list(self.pending)
+        else:
+            keys = [key for key in self.pending if key[0] == name]
+        for key in keys:
+            self.meta, arr = self.pending.pop(key)
+            self.do_operation(arr)
+
+    def show_history(self, name, index):
+        """Shows a plot as it was once frame index of its history had arrived, the newest makes it live again"""
+        span = self.history.span(name)
+        if span is None or name not in self.namelist:
+            return
+        if index >= span[1]:
+            self.scrubbed.pop(name, None)
+        else:
+            self.scrubbed[name] = index
+        # they are in the history
+        for key in [key for key in self.pending if key[0] == name and self.pending[key][0]['operation'] in HISTORY]:
+            del self.pending[key]
+        for self.meta, arr in self.history.at(name, index):
+            self.do_operation(arr)
+        self.namelist[name].set_history(*span, live=name not in self.scrubbed)
+
+    def render_frame(self):
+        self.apply_pending()
+        if self.history is not None:
+            for name in self.history.changes():
+                span = self.history.span(name)
+                if span is not None and name in self.namelist:
+                    self.namelist[name].set_history(*span, live=name not in self.scrubbed)
+        for name in self.namelist.keys():
+            self.namelist[name].render()
+        self.backlog = sum(client.frames.complete for client in self.clients)
+        unread = sum(client.conn.bytesAvailable() for client in self.clients)
+        now = time.perf_counter()
+        if now > self.stats_time + STATS_INTERVAL:
+            self.client_stats = [client.stats(now - self.stats_time) for client in self.clients]
+            self.stats_time = now
+            for stats in self.client_stats:
+                logging.debug('%(name)s: %(bytes_per_s)d B/s, %(messages_per_s)d messages/s, '
+                              'longest wait %(wait)f s' % stats)
+        status = []
+        if self.recording is not None:
+            status.append('Replay: message %d of %d' % (self.replay_index, len(self.recording)))
+        if self.backlog or unread:
+            status.append('Backlog: %d messages, %d kB unread' % (self.backlog, unread // 1024))
+        if len(self.client_stats) > 1:
+            status += ['%(name)s: %(bytes_per_s).3g B/s, %(messages_per_s).3g msg/s, wait %(wait).3g s' % stats
+                       for stats in self.client_stats]
+        status = '   '.join(status)
+        if status != self.status:
+            self.status = status
+            self.statusBar().showMessage(status)
+
+    def do_batch(self, client, meta):
+        """Prepares all operations of a batch together, then frees its slot with a single ack"""
+        ops = []
+        frames = protocol.FrameReader()
+        frames.feed(meta['value'])
+        for frame in frames:
+            sub = client.decoder.decode(frame)
+            if sub is not None:
+                ops.append((sub, None))
+        if 'slot' not in meta:
+            self.submit(client, lambda _: [self.ingest(sub) for sub, _ in ops])
+            return
+        client.check_slot(meta)
+        ops = [(sub, client.array(sub) if 'slot' in sub else None) for sub, _ in ops]
+        self.submit(client, lambda prepared: self.acked(client, prepared), prepare, ops, self.workers is not None)
 
 
     #     if not self.target_size:
@@ -117,11 +566,19 @@ class MainWindow(QMainWindow):
 
         def remove(name):
             del self.namelist[name]
+            self.forget(name)
 
         meta = self.meta
         operation = meta['operation']
         name = meta['name']
 
+        # empty arrays are sent without one: an empty curve is still a curve, an empty image
+        # or part of one changes nothing
+        if arr is None and operation in ('plot_y', 'plot_xy'):
+            arr = np.empty((0,) if operation == 'plot_y' else (2, 0))
+        elif arr is None and operation in ('plot_z', 'append_z', 'update_y', 'update_z'):
+            return
+
         if name in self.namelist:
             pw = self.namelist[name]
             if pw.closed:
@@ -137,7 +594,7 @@ class MainWindow(QMainWindow):
                 list(map(remove, list(self.namelist.keys())))
             return
         else:
-            if operation in ('clear', 'close', 'remove','none'):
+            if operation in ('clear', 'close', 'remove'):
                 return
             pw = self.add_new_plot(meta['rank'], name)
 
@@ -145,10 +602,9 @@ class MainWindow(QMainWindow):
             pw.clear()
         elif operation == 'close':
             pw.close()
-        elif operation == 'none':
-            pass
         elif operation == 'remove':
             del self.namelist[name]
+            self.forget(name)
 
 
         elif operation == 'plot_y':
@@ -157,10 +613,10 @@ class MainWindow(QMainWindow):
             if start_step is not None:
                 x0, dx = start_step
                 nx = len(arr)
-                xs = np.linspace(x0, x0 + (nx - 1)*dx, nx)
-                pw.plot(xs, arr, name=label)
+                xs = meta['xs'] if 'xs' in meta else np.linspace(x0, x0 + (nx - 1)*dx, nx)
+                pw.plot(xs, arr, name=label, lod=meta.get('lod'))
             else:
-                pw.plot(arr, name=label)
+                pw.plot(arr, name=label, lod=meta.get('lod'))
 
 
         elif operation == 'plot_xy':
@@ -181,13 +637,28 @@ class MainWindow(QMainWindow):
             yscal = meta['Y']
             znam = meta['Zname']
             zscal = meta['Z']
+            pw.set_autoscale(meta.get('percentiles'), meta.get('relevel_every'), meta.get('level_smoothing'))
             if start_step is not None:
                 (x0, dx), (y0, dy) = start_step
                 pw.setAxisLabels(xname=xnam, xscale =xscal, yname=ynam, yscale =yscal, zname=znam, zscale =zscal)
-                pw.setImage(arr, pos=(x0, y0), scale=(dx, dy), axes={'y':0, 'x':1})
+                pw.setImage(arr, pos=(x0, y0), scale=(dx, dy), axes={'y':0, 'x':1}, auto_levels=meta.get('levels'))
             else:
                 pw.setAxisLabels(xname=xnam, xscale =xscal, yname=ynam, yscale =yscal, zname=znam, zscale =zscal)
-                pw.setImage(arr, axes={'y':0, 'x':1})
+                pw.setImage(arr, axes={'y':0, 'x':1}, auto_levels=meta.get('levels'))
+
+
+        elif operation == 'update_y':
+            if not isinstance(pw, widgets.CrosshairDock):
+                logging.warning("can't update_y %s, it isn't a curve plot" % name)
+                return
+            pw.update_y(arr, meta['origin'], name=meta['label'])
+
+
+        elif operation == 'update_z':
+            if not isinstance(pw, widgets.CrossSectionDock):
+                logging.warning("can't update_z %s, it isn't an image plot" % name)
+                return
+            pw.update_region(arr, meta['origin'])
 
 
         elif operation == 'append_y':
@@ -196,40 +667,17 @@ class MainWindow(QMainWindow):
             xscal = meta['X']
             ynam = meta['Yname']
             yscal = meta['Y']
-
-            xs, ys = pw.get_data(label)
-            new_ys = list(ys)
-            new_ys.append(meta['value'])
-            start_step = meta['start_step']
-            if start_step is not None:
-                x0, dx = start_step
-                nx = len(new_ys)
-                xs = np.linspace(x0, x0 + (nx - 1)*dx, nx)
-                pw.plot(xs, new_ys, name=label, xname=xnam, xscale =xscal, yname=ynam, yscale =yscal)
-            else:
-                pw.plot(new_ys, name=label, xname=xnam, xscale =xscal, yname=ynam, yscale =yscal)
+            pw.append_y(meta['value'], start_step=meta['start_step'], max_points=meta.get('max_points'),
+                        name=label, xname=xnam, xscale =xscal, yname=ynam, yscale =yscal)
 
 
         elif operation == 'append_xy':
             label = meta['label']
-            xs, ys = pw.get_data(label)
             xn, yn = meta['value']
-            new_xs = list(xs)
-            new_xs.append(xn)
-            new_ys = list(ys)
-            new_ys.append(yn)
-            pw.plot(new_xs, new_ys, parametric=True, name=label)
+            pw.append_xy(xn, yn, max_points=meta.get('max_points'), name=label)
 
 
         elif operation == 'append_z':
-            image = pw.get_data()
-            if image is None:
-                image = np.array([arr])
-            else:
-                try:
-                    image = np.vstack((np.transpose(image), [arr]))
-                except ValueError:
-                    image = np.array([arr])
             start_step = meta['start_step']
             xnam = meta['Xname']
             xscal = meta['X']
@@ -237,13 +685,13 @@ class MainWindow(QMainWindow):
             yscal = meta['Y']
             znam = meta['Zname']
             zscal = meta['Z']
+            pw.setAxisLabels(xname=xnam, xscale =xscal, yname=ynam, yscale =yscal, zname=znam, zscale =zscal)
+            pw.set_autoscale(None, meta.get('relevel_every'), meta.get('level_smoothing'))
             if start_step is not None:
                 (x0, dx), (y0, dy) = start_step
-                pw.setAxisLabels(xname=xnam, xscale =xscal, yname=ynam, yscale =yscal, zname=znam, zscale =zscal)
-                pw.setImage(image, pos=(x0, y0), scale=(dx, dy), axes={'y':0, 'x':1})
+                pw.append_row(arr, max_rows=meta.get('max_rows'), pos=(x0, y0), scale=(dx, dy))
             else:
-                pw.setAxisLabels(xname=xnam, xscale =xscal, yname=ynam, yscale =yscal)
-                pw.setImage(image, axes={'y':0, 'x':1})
+                pw.append_row(arr, max_rows=meta.get('max_rows'))
 
 
         elif operation == 'label':
@@ -253,8 +701,15 @@ class MainWindow(QMainWindow):
         pw = widgets.get_widget(rank, name)
         self.add_plot(pw)
         self.namelist[name] = pw
+        pw.scrubbed.connect(lambda index: self.show_history(name, index))
         return pw
 
+    def forget(self, name):
+        """Drops the history of a removed plot"""
+        self.scrubbed.pop(name, None)
+        if self.history is not None:
+            self.history.forget(name)
+
     def add_plot(self, pw):
         self.insert_dock_right = not self.insert_dock_right
         self.dockarea.addDock(pw, position=['bottom', 'right'][self.insert_dock_right])
@@ -263,6 +718,273 @@ class MainWindow(QMainWindow):
         return QSize(1000, 600)
 
 
+class Client(object):
+    """
+    State of one connected LivePlotClient: its socket, shared memory and slot ring. lent
+    is the key of the memory if it is a segment of the window's SegmentPool.
+    """
+    def __init__(self, conn, memory, frames, decoder, slots, lent=None):
+        self.conn = conn
+        self.frames = frames
+        self.decoder = decoder
+        self.lend(lent, memory, slots)
+        if lent is None:
+            atexit.register(memory.detach)
+        # (future, then) of messages submitted to the ingest pool, see MainWindow.submit
+        self.jobs = collections.deque()
+        # Stream of the array being streamed
+        self.stream = None
+        self.reading = False
+        self.dropped = False
+        # as told by the hello, see Scheduler
+        self.name = 'client'
+        self.priority = 0
+        self.weight = 1
+        # what is left of the client's share of the scheduler round, and since when
+        # it has had messages waiting for its turn
+        self.credit = 0
+        self.messages_left = 0
+        self.waiting_since = None
+        # read since the statistics were last taken, and the longest wait for a turn
+        self.bytes_read = 0
+        self.messages_read = 0
+        self.longest_wait = 0
+
+    def start_turn(self):
+        """Grants the client its share of a scheduler round, less what it overdrew in the last one"""
+        now = time.perf_counter()
+        if self.waiting_since is not None:
+            self.longest_wait = max(self.longest_wait, now - self.waiting_since)
+        self.waiting_since = now
+        self.credit = min(self.credit, 0) + self.weight*QUANTUM
+        self.messages_left = int(np.ceil(self.weight*MESSAGES))
+
+    def spend(self, size):
+        self.credit -= size
+        self.messages_left -= 1
+        self.bytes_read += size
+        self.messages_read += 1
+
+    def turn_over(self):
+        return self.credit <= 0 or self.messages_left <= 0
+
+    def stats(self, interval):
+        """Throughput and longest wait for a turn over the last interval seconds, then starts over"""
+        stats = {
+            'name': self.name,
+            'priority': self.priority,
+            'weight': self.weight,
+            'bytes_per_s': self.bytes_read / interval,
+            'messages_per_s': self.messages_read / interval,
+            'wait': self.longest_wait,
+        }
+        self.bytes_read = self.messages_read = self.longest_wait = 0
+        return stats
+
+    def lend(self, key, memory, slots):
+        """Starts using memory (lent from the pool as key, unless key is None) as the slot ring"""
+        self.memory = memory
+        self.lent = key
+        self.region = np.frombuffer(memory.constData(), np.uint8)
+        self.slots = slots
+        self.slot_size = protocol.slot_size(memory.size(), slots)
+        self.seq = 0
+
+    def check_slot(self, meta):
+        """Makes sure the message's slot is the next one in the ring and holds its payload"""
+        slot, seq = meta['slot'], meta['seq']
+        if seq != self.seq or slot != seq % self.slots:
+            raise ValueError('Expected message %s in slot %s, got %s in slot %s'
+                             % (self.seq, self.seq % self.slots, seq, slot))
+        written, = protocol.SEQ.unpack_from(self.region, slot*self.slot_size)
+        if written != seq:
+            raise ValueError('Slot %s holds message %s, expected %s' % (slot, written, seq))
+        self.seq += 1
+
+    def array(self, meta):
+        """
+        Returns a view of the array in the slot, valid until the slot is acknowledged.
+        Anything that keeps the array around after that has to copy it.
+        """
+        offset = protocol.slot_offset(meta['slot'], self.slot_size) + meta['offset']
+        return self.region[offset:offset + meta['arrsize']].view(meta['dtype']).reshape(meta['shape'])
+
+    def payload(self, meta, n):
+        """The first n bytes of the message's payload, valid until the slot is acknowledged"""
+        offset = protocol.slot_offset(meta['slot'], self.slot_size) + meta['offset']
+        return self.region[offset:offset + n]
+
+    def used(self, meta):
+        """The part of the message's slot in use, valid until the slot is acknowledged"""
+        offset = protocol.slot_offset(meta['slot'], self.slot_size)
+        return self.region[offset:offset + min(meta['offset'] + meta['arrsize'], self.slot_size - protocol.SLOT_HEADER)]
+
+    def detach(self):
+        self.region = None
+        if self.lent is None:
+            self.memory.detach()
+            atexit.unregister(self.memory.detach)
+
+    def ack(self):
+        if self.dropped:
+            return
+        self.conn.write(protocol.ACK)
+        self.conn.flush()
+
+
+class Stream(object):
+    """
+    The array of an operation that is streamed, see protocol. Its pieces are copied straight
+    into memory of its own, which the operation then keeps.
+    """
+    def __init__(self, meta):
+        self.meta = meta
+        self.data = np.empty(meta['arrsize'], np.uint8)
+        # bytes handed to the ingest pool, and copied by it, in order
+        self.queued = 0
+        self.received = 0
+        self.progress_shown = time.perf_counter()
+
+    def piece(self, n):
+        """Where the next n bytes go, no more than are still missing"""
+        start, self.queued = self.queued, min(self.queued + n, len(self.data))
+        return self.data[start:self.queued]
+
+    def partial(self):
+        """The part of the array's first axis that has been copied"""
+        meta = self.meta
+        row = int(np.prod(meta['shape'][1:]))*meta['dtype'].itemsize
+        rows = self.received // row
+        return self.data[:rows*row].view(meta['dtype']).reshape([rows] + list(meta['shape'][1:]))
+
+    def array(self):
+        return self.data.view(self.meta['dtype']).reshape(self.meta['shape'])
+
+
+class Scheduler(object):
+    """
+    Decides whose messages the window reads next. Clients with messages waiting are
+    served in rounds: in every round the clients of higher priority come first, and
+    clients of the same priority take turns, the one served longest ago first. A turn
+    ends once a client has read its share of the round, weight times QUANTUM bytes or
+    MESSAGES messages. A message can overdraw the share, and the next round's share is
+    smaller by as much (deficit round robin). So a camera sending big images gets no
+    more than its share when others are waiting, and a client sending a few small
+    messages never waits for more than a turn of each of the others.
+    """
+    def __init__(self):
+        # in the order they are served, among clients of the same priority
+        self.ready = []
+
+    def wake(self, client):
+        if client not in self.ready:
+            self.ready.append(client)
+            if client.waiting_since is None:
+                client.waiting_since = time.perf_counter()
+
+    def round(self):
+        return sorted(self.ready, key=lambda client: -client.priority)
+
+    def served(self, client, more):
+        """A client had its turn, it goes to the back if it has more messages waiting"""
+        if client in self.ready:
+            self.ready.remove(client)
+        if more:
+            self.ready.append(client)
+        else:
+            client.waiting_since = None
+            client.credit = min(client.credit, 0)
+
+
+class SegmentPool(object):
+    """
+    Shared memory segments the window lends to clients that don't bring their own. A
+    segment comes back when its client disconnects or asks for another size, and is lent
+    to the next client asking for no more than its size, so a script that is run over and
+    over attaches to memory that already exists instead of creating some for every run.
+    Only the `idle` most recently returned segments are kept, older ones are destroyed.
+    """
+    def __init__(self, idle=4, slack=4):
+        self.idle = idle
+        self.slack = slack
+        # (key, memory) of the segments not lent to anyone, most recently returned last
+        self.free = []
+        self.lent = {}
+
+    def take(self, size, posix=False):
+        """
+        A segment of at least size bytes as (key, memory), raises EnvironmentError if none can be
+        made. Free segments more than `slack` times too big are left for bigger requests.
+        """
+        fits = [seg for seg in self.free if seg[0].startswith(protocol.POSIX_PREFIX) == posix
+                and size <= seg[1].size() <= self.slack*size]
+        if fits:
+            key, memory = min(fits, key=lambda seg: seg[1].size())
+            self.free.remove((key, memory))
+        elif posix:
+            memory = PosixMemory(size=size)
+            key = protocol.POSIX_PREFIX + memory.shm.name
+        else:
+            key = str(uuid.uuid4())
+            memory = QSharedMemory(key)
+            if not memory.create(size):
+                raise EnvironmentError("Couldn't create shared memory %s" % memory.errorString())
+        self.lent[key] = memory
+        return key, memory
+
+    def put(self, key):
+        self.free.append((key, self.lent.pop(key)))
+        while len(self.free) > self.idle:
+            self.destroy(self.free.pop(0)[1])
+
+    def destroy(self, memory):
+        memory.detach()
+        if isinstance(memory, PosixMemory):
+            memory.unlink()
+
+    def clear(self):
+        while self.free:
+            self.destroy(self.free.pop()[1])
+        while self.lent:
+            self.destroy(self.lent.popitem()[1])
+
+
+class PosixMemory(object):
+    """
+    POSIX shared memory of a client that does without Qt (AsyncLivePlotClient), with the
+    part of the QSharedMemory interface the window uses. Given a size instead of a name it
+    creates a segment for the SegmentPool.
+    """
+    def __init__(self, name=None, size=0):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # the client unlinks it, this process must not do so at exit as well
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+    def size(self):
+        return self.shm.size
+
+    def constData(self):
+        return self.shm.buf
+
+    def isAttached(self):
+        return self.shm.buf is not None
+
+    def detach(self):
+        if self.shm.buf is None:
+            return
+        try:
+            self.shm.close()
+        except BufferError:
+            # an array still looks into it, the mapping goes away with the array
+            pass
+
+    def unlink(self):
+        self.shm.unlink()
+
+
 class NameList(QDockWidget):
     def __init__(self, window):
         super(NameList, self).__init__('Current Plots')
@@ -323,14 +1045,55 @@ class NameList(QDockWidget):
         return list(self.plot_dict.keys());
 
 
+def frame_rate(text):
+    """The --fps argument"""
+    fps = float(text)
+    if not fps > 0:
+        raise argparse.ArgumentTypeError('fps must be positive, got %s' % text)
+    return fps
+
+
+def replay_speed(text):
+    """The --speed argument: a factor such as 10x, or max"""
+    speed = float('inf') if text == 'max' else float(text.rstrip('x'))
+    if not speed > 0:
+        raise argparse.ArgumentTypeError('speed must be positive, got %s' % text)
+    return speed
+
+
 def main():
     if os.name == 'nt':
         import ctypes
         myappid = 'philreinhold.liveplot'
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
+    parser = argparse.ArgumentParser(description='Liveplot window')
+    parser.add_argument('--fps', type=frame_rate, default=30, help='screen updates per second (default 30)')
+    parser.add_argument('--budget', type=float, default=20,
+                        help='milliseconds spent reading messages before the window handles input again (default 20)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='threads copying arrays out of shared memory and preparing them '
+                             '(default 2 if there are cores to spare, 0 otherwise)')
+    parser.add_argument('--history', type=float, default=256,
+                        help='megabytes of earlier plot_y and plot_z frames kept in memory (default 256)')
+    parser.add_argument('--spill', type=float, default=0,
+                        help='megabytes of frames kept in a file once those in memory are used up (default 0)')
+    parser.add_argument('--spill-dir', default=None,
+                        help='directory of that file (default the temp directory)')
+    parser.add_argument('--record', metavar='SESSION', default=None,
+                        help='records every message the window reads to a session file')
+    parser.add_argument('--replay', metavar='SESSION', default=None, help='plays back a recorded session')
+    parser.add_argument('--speed', type=replay_speed, default='1x',
+                        help="of the replay, relative to the recording, 'max' for as fast as possible (default 1x)")
+    parser.add_argument('--start', type=float, default=None, help='seconds into the session to replay from')
+    parser.add_argument('--start-message', type=int, default=0, help='message of the session to replay from')
+    args = parser.parse_args()
+
     app = QApplication([])
-    win = MainWindow()
+    win = MainWindow(fps=args.fps, budget=args.budget, workers=args.workers, history_memory=int(args.history*2**20),
+                     history_spill=int(args.spill*2**20), spill_dir=args.spill_dir, record=args.record)
+    if args.replay is not None:
+        win.replay(args.replay, args.speed, args.start_message, args.start)
     win.show()
     app.exec_()
 
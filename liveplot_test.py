@@ -32,6 +32,12 @@ def test_append_y():
         c.append_y('appending exp', -val, start_step=(xs[0], xs[1]-xs[0]), label='down')
         yield
 
+def test_append_y_scrolling():
+    xs = np.linspace(0, 30, 600)
+    for x in xs:
+        c.append_y('scrolling window', np.sin(x), start_step=(xs[0], xs[1]-xs[0]), label='sin', max_points=100)
+        yield
+
 def test_plot_xy_parametric():
     for i in range(100):
         ts = np.linspace(0, 20, 300) + i/20.
@@ -58,6 +64,14 @@ def test_plot_z():
         c.plot_z('sinc', np.sinc(rs + i/20.), extent=((-5, 5), (-10, 10)))
         yield
 
+def test_plot_z_slow_levels():
+    xs, ys = np.mgrid[-200:200, -200:200]/40.
+    rs = np.sqrt(xs**2 + ys**2)
+    for i in range(200):
+        noisy = np.sinc(rs)*(1 + np.sin(i/10.)) + np.random.normal(0, .05, rs.shape)
+        c.plot_z('slow levels', noisy, percentiles=(1, 99), level_smoothing=0.1)
+        yield
+
 def test_plot_huge():
     xs, ys = np.mgrid[-1500:1500, -1500:1500]/1000.
     z = np.sqrt(xs**2 + ys**2)
@@ -73,6 +87,30 @@ def test_append_z():
         c.append_z('appending sinc', zs[:,i])
         yield
 
+def test_append_z_waterfall():
+    c.clear('waterfall')
+    xs = np.linspace(-5, 5, 400)
+    for i in range(600):
+        c.append_z('waterfall', np.sinc(xs + np.sin(i / 50.)), max_rows=200)
+        yield
+
+def test_update_z():
+    c.clear('line scan')
+    xs, ys = np.mgrid[-100:100, -100:100]/20.
+    zs = np.sinc(np.sqrt(xs**2 + ys**2))
+    for i in range(200):
+        c.update_z('line scan', zs[i], offset=(i, 0))
+        yield
+
+def test_batch():
+    xs = np.linspace(0, 10, 500)
+    for i in range(100):
+        with c.batch():
+            for j in range(5):
+                c.plot_y('batched curves', np.sin(xs + i/10. + j), label=str(j))
+            c.label('batched curves', 'step: %d' % i)
+        yield
+
 def test_label():
     c.clear('label test')
     xs, ys = np.mgrid[-100:100, -100:100]/20.
@@ -107,10 +145,15 @@ class TestWindow(QWidget):
             'plot xy': test_plot_xy,
             'plot parametric': test_plot_xy_parametric,
             'plot z': test_plot_z,
+            'plot z slow levels': test_plot_z_slow_levels,
             'plot huge': test_plot_huge,
             'append y': test_append_y,
+            'append y scrolling': test_append_y_scrolling,
             'append xy': test_append_xy,
             'append z': test_append_z,
+            'append z waterfall': test_append_z_waterfall,
+            'update z': test_update_z,
+            'batch': test_batch,
             'label': test_label,
         }
         fn_text_widget = QPlainTextEdit()
@@ -145,7 +188,7 @@ class TestWindow(QWidget):
 
 if __name__ == "__main__":
     app = QApplication([])
-    c = LivePlotClient(size=2**28)
+    c = LivePlotClient()
     win = TestWindow()
     win.show()
     def clean():